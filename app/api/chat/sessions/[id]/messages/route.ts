@@ -7,7 +7,7 @@ export async function GET(
   { params }: { params: { id: string } }
 ) {
   try {
-    const response = await fetch(`${BACKEND_URL}/api/chat/sessions/${params.id}/messages/`, {
+    const response = await fetch(`${BACKEND_URL}/api/chat/sessions/${params.id}/messages/${request.nextUrl.search}`, {
       headers: {
         'Content-Type': 'application/json',
       },
@@ -2,9 +2,9 @@ import { NextRequest, NextResponse } from 'next/server'
 
 const BACKEND_URL = process.env.BACKEND_URL || 'http://backend:8000'
 
-export async function GET() {
+export async function GET(request: NextRequest) {
   try {
-    const response = await fetch(`${BACKEND_URL}/api/chat/sessions/`, {
+    const response = await fetch(`${BACKEND_URL}/api/chat/sessions/${request.nextUrl.search}`, {
       headers: {
         'Content-Type': 'application/json',
       },
@@ -1,5 +1,7 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse
+from typing import List, AsyncIterator, Optional
+import json
 from services.chat_service import ChatService
 from models.schemas import (
     ChatSessionCreate, 
@@ -11,9 +13,12 @@ from models.schemas import (
 
 router = APIRouter()
 
+# Shared chat service so model caches persist across requests
+chat_service_instance = ChatService()
+
 # Dependency to get chat service
 def get_chat_service() -> ChatService:
-    return ChatService()
+    return chat_service_instance
 
 @router.post("/sessions", response_model=ChatSessionResponse)
 async def create_chat_session(
@@ -30,22 +35,26 @@ async def create_chat_session(
 
 @router.get("/sessions", response_model=List[ChatSessionResponse])
 async def get_chat_sessions(
+    limit: Optional[int] = Query(None, ge=1, le=500),  # No limit: every session (the frontend does not page)
+    offset: int = Query(0, ge=0),
     chat_service: ChatService = Depends(get_chat_service)
 ):
-    """Get all chat sessions"""
+    """Get chat sessions, most recently updated first"""
     try:
-        return await chat_service.get_sessions()
+        return await chat_service.get_sessions(limit=limit, offset=offset)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get sessions: {e}")
 
 @router.get("/sessions/{session_id}/messages", response_model=List[ChatMessageResponse])
 async def get_session_messages(
     session_id: int,
+    limit: Optional[int] = Query(None, ge=1, le=500),  # No limit: the full history
+    offset: int = Query(0, ge=0),
     chat_service: ChatService = Depends(get_chat_service)
 ):
-    """Get all messages for a chat session"""
+    """Get the messages for a chat session, optionally only the latest page"""
     try:
-        return await chat_service.get_session_messages(session_id)
+        return await chat_service.get_session_messages(session_id, limit=limit, offset=offset)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get messages: {e}")
 
@@ -62,6 +71,30 @@ async def generate_chat_response(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate response: {e}")
 
+@router.post("/generate/stream")
+async def generate_chat_response_stream(
+    request: ChatGenerateRequest,
+    chat_service: ChatService = Depends(get_chat_service)
+):
+    """Stream a response as Server-Sent Events while it is being generated"""
+    try:
+        chunks = await chat_service.stream_response(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to generate response: {e}")
+    return StreamingResponse(
+        _sse_events(chunks),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _sse_events(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Wrap response text chunks as SSE `data:` events, ending with a done event"""
+    async for chunk in chunks:
+        yield f"data: {json.dumps({'response': chunk}, ensure_ascii=False)}\n\n"
+    yield f"data: {json.dumps({'done': True})}\n\n"
+
 @router.delete("/sessions/{session_id}")
 async def delete_chat_session(
     session_id: int,
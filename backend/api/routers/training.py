@@ -1,18 +1,28 @@
 from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, delete
-from typing import List
+from typing import List, AsyncIterator
+import asyncio
+import json
+import time
 
-from database.database import get_db
+from database.database import get_db, AsyncSessionLocal
 from models.database_models import TrainingJob, Dataset, TrainingMetrics, ChatSession, ChatMessage
 from models.schemas import (
     TrainingJobCreate, TrainingJobResponse, TrainingStatus, 
     TrainingProgress
 )
 from services.training_service import TrainingService
+from api.routers.chat import chat_service_instance
 
 router = APIRouter()
 
+# Job event stream: DB check interval and keep-alive comment interval (seconds)
+EVENT_POLL_INTERVAL = 1.0
+EVENT_HEARTBEAT_INTERVAL = 15.0
+TERMINAL_STATUSES = (TrainingStatus.COMPLETED, TrainingStatus.FAILED, TrainingStatus.CANCELLED)
+
 @router.post("/jobs", response_model=TrainingJobResponse)
 async def create_training_job(
     job: TrainingJobCreate,
@@ -179,6 +189,50 @@ async def get_training_progress(job_id: int, db: AsyncSession = Depends(get_db))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/jobs/{job_id}/events")
+async def stream_training_events(job_id: int, db: AsyncSession = Depends(get_db)):
+    """Stream job status/progress changes as Server-Sent Events until the job finishes"""
+    result = await db.execute(select(TrainingJob.id).where(TrainingJob.id == job_id))
+    if result.scalar_one_or_none() is None:
+        raise HTTPException(status_code=404, detail="Training job not found")
+    return StreamingResponse(
+        _job_events(job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _job_events(job_id: int) -> AsyncIterator[str]:
+    """Poll the job row in-process and emit an SSE event only when something changed"""
+    last_event = None
+    last_sent = time.monotonic()
+    while True:
+        # Short-lived session per check so the stream does not pin a pooled connection for the whole job
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(
+                    TrainingJob.status, TrainingJob.progress, TrainingJob.current_epoch,
+                    TrainingJob.current_step, TrainingJob.total_steps, TrainingJob.loss,
+                    TrainingJob.current_stage, TrainingJob.error_message
+                ).where(TrainingJob.id == job_id)
+            )
+            row = result.one_or_none()
+        if row is None:
+            yield f"data: {json.dumps({'status': 'deleted', 'job_id': job_id})}\n\n"
+            return
+        
+        event = {"job_id": job_id, **row._asdict()}
+        if event != last_event:
+            yield f"data: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+            last_event = event
+            last_sent = time.monotonic()
+        elif time.monotonic() - last_sent >= EVENT_HEARTBEAT_INTERVAL:
+            yield ": keep-alive\n\n"
+            last_sent = time.monotonic()
+        
+        if row.status in TERMINAL_STATUSES:
+            return
+        await asyncio.sleep(EVENT_POLL_INTERVAL)
+
 @router.post("/jobs/{job_id}/cancel")
 async def cancel_training_job(job_id: int, db: AsyncSession = Depends(get_db)):
     """Cancel a training job"""
@@ -240,6 +294,10 @@ async def delete_training_job(job_id: int, db: AsyncSession = Depends(get_db)):
             await db.delete(job)
             await db.commit()
             
+            # Deleted sessions must not be served from the chat service's session cache
+            for session_id in chat_session_ids:
+                chat_service_instance.invalidate_session(session_id)
+            
             return {"message": "Training job deleted successfully"}
         except Exception as cleanup_error:
             await db.rollback()
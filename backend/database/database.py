@@ -26,6 +26,13 @@ async def get_db():
         finally:
             await session.close()
 
+def _create_missing_indexes(connection):
+    # create_all only builds indexes together with new tables; add later ones to existing databases
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
 async def init_db():
     async with async_engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_create_missing_indexes)
\ No newline at end of file
@@ -31,52 +31,56 @@ def test_model(model_path, test_prompts):
         print(f"Vocab size: {tokenizer.vocab_size}")
         print("-" * 50)
         
-        for i, prompt in enumerate(test_prompts, 1):
-            print(f"\nTest {i}: '{prompt}'")
-            
-            # Test different prompt formats
-            formats = [
+        # Test different prompt formats
+        def make_formats(prompt):
+            return [
                 prompt,  # Raw
                 f"User: {prompt} Bot:",  # Current format
                 f"{prompt}<|endoftext|>",  # Training format
                 f"Human: {prompt}\nAssistant:",  # Alternative format
             ]
-            
-            for j, formatted_prompt in enumerate(formats):
-                print(f"\n  Format {j+1}: '{formatted_prompt}'")
-                
-                # Tokenize
-                inputs = tokenizer(formatted_prompt, return_tensors="pt")
-                print(f"  Tokens: {inputs['input_ids'].shape[1]} tokens")
-                print(f"  Token IDs: {inputs['input_ids'][0].tolist()}")
-                
-                # Generate
-                with torch.no_grad():
-                    outputs = model.generate(
-                        inputs['input_ids'],
-                        max_new_tokens=20,
-                        min_new_tokens=1,
-                        temperature=0.7,
-                        do_sample=True,
-                        pad_token_id=tokenizer.eos_token_id,
-                        eos_token_id=tokenizer.eos_token_id,
-                    )
-                
-                # Decode full output
-                full_output = tokenizer.decode(outputs[0], skip_special_tokens=True)
-                
-                # Extract new tokens only
-                input_length = inputs['input_ids'].shape[1]
-                if outputs.shape[1] > input_length:
-                    new_tokens = outputs[0][input_length:]
-                    response = tokenizer.decode(new_tokens, skip_special_tokens=True)
-                else:
-                    response = ""
-                
-                print(f"  Full output: '{full_output}'")
-                print(f"  Response only: '{response}'")
-                print(f"  Response length: {len(response)} chars")
         
+        # Tokenize every prompt x format in one call; left padding keeps each prompt flush with the generated tokens
+        all_prompts = [fmt for prompt in test_prompts for fmt in make_formats(prompt)]
+        tokenizer.padding_side = "left"
+        enc = tokenizer(all_prompts, return_tensors="pt", padding=True)
+        
+        # Generate all rows in a single batched call
+        with torch.inference_mode():
+            outputs = model.generate(
+                input_ids=enc.input_ids,
+                attention_mask=enc.attention_mask,
+                max_new_tokens=20,
+                min_new_tokens=1,
+                temperature=0.7,
+                do_sample=True,
+                pad_token_id=tokenizer.pad_token_id,
+                eos_token_id=tokenizer.eos_token_id,
+            )
+        
+        input_length = enc.input_ids.shape[1]
+        num_formats = len(all_prompts) // len(test_prompts)
+        for row, formatted_prompt in enumerate(all_prompts):
+            i, j = divmod(row, num_formats)
+            if j == 0:
+                print(f"\nTest {i+1}: '{test_prompts[i]}'")
+            print(f"\n  Format {j+1}: '{formatted_prompt}'")
+            
+            # Padding positions are masked out of the per-row token listing
+            token_ids = enc.input_ids[row][enc.attention_mask[row].bool()].tolist()
+            print(f"  Tokens: {len(token_ids)} tokens")
+            print(f"  Token IDs: {token_ids}")
+            
+            # Decode full output (prompt + new tokens, pads skipped)
+            full_output = tokenizer.decode(outputs[row], skip_special_tokens=True)
+            
+            # Extract new tokens only
+            response = tokenizer.decode(outputs[row, input_length:], skip_special_tokens=True)
+            
+            print(f"  Full output: '{full_output}'")
+            print(f"  Response only: '{response}'")
+            print(f"  Response length: {len(response)} chars")
+
     except Exception as e:
         print(f"Error: {e}")
         import traceback
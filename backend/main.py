@@ -6,6 +6,7 @@ from dotenv import load_dotenv
 
 from api.routers import models, datasets, training, chat
 from database.database import init_db
+from services.ollama_service import ollama_service
 
 load_dotenv()
 
@@ -15,6 +16,7 @@ async def lifespan(app: FastAPI):
     await init_db()
     yield
     # Shutdown
+    await ollama_service.aclose()
 
 app = FastAPI(
     title="LLM LoRA Fine-tuning API",
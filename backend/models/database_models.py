@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Float, JSON, Enum, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, Float, JSON, Enum, Boolean, ForeignKey, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from database.database import Base
@@ -89,10 +89,15 @@ class ChatMessage(Base):
     __tablename__ = "chat_messages"
 
     id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(Integer, ForeignKey("chat_sessions.id"), nullable=False)
+    session_id = Column(Integer, ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=False)
     role = Column(Enum(ChatMessageRole), nullable=False)
     content = Column(Text, nullable=False)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationship
-    session = relationship("ChatSession")
\ No newline at end of file
+    session = relationship("ChatSession")
+
+    # Message history is always read per session in timestamp order
+    __table_args__ = (
+        Index("ix_chat_messages_session_id_timestamp", "session_id", "timestamp"),
+    )
\ No newline at end of file
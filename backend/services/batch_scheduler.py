@@ -0,0 +1,121 @@
+import asyncio
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+import torch
+from torch.nn.utils.rnn import pad_sequence
+from loguru import logger
+
+
+class _PendingRequest(NamedTuple):
+    input_ids: torch.Tensor  # 1-D prompt token ids
+    attention_mask: torch.Tensor  # 1-D attention mask
+    max_new_tokens: int
+    temperature: float
+    future: asyncio.Future
+
+
+class BatchScheduler:
+    """Micro-batches concurrent generate() calls for one model into a single padded batch"""
+
+    def __init__(
+        self,
+        model,
+        pad_token_id: int,
+        gen_kwargs: Dict[str, Any],
+        max_batch: int = 8,
+        max_latency_ms: float = 15.0,
+        idle_timeout: float = 60.0,
+        sampling_kwargs: Optional[Callable[[float], Dict[str, Any]]] = None,
+        executor: Optional[Executor] = None
+    ):
+        self.model = model
+        self.pad_token_id = pad_token_id
+        self.gen_kwargs = gen_kwargs
+        self.max_batch = max_batch
+        self.max_latency = max_latency_ms / 1000.0
+        self.idle_timeout = idle_timeout
+        self.sampling_kwargs = sampling_kwargs or (lambda temperature: {"temperature": temperature})  # temperature -> generate() kwargs
+        self.executor = executor  # None -> the loop's default executor
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+
+    async def submit(
+        self,
+        input_ids: torch.Tensor,
+        attention_mask: torch.Tensor,
+        max_new_tokens: int,
+        temperature: float
+    ) -> torch.Tensor:
+        """Queue a single prompt and wait for its generated sequence (prompt + new tokens)"""
+        # The worker exits after idle_timeout so evicted models are not kept alive by it
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_PendingRequest(input_ids, attention_mask, max_new_tokens, temperature, future))
+        return await future
+
+    async def _run(self):
+        """Drain the queue into batches of up to max_batch requests or max_latency seconds"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                first = await asyncio.wait_for(self._queue.get(), timeout=self.idle_timeout)
+            except asyncio.TimeoutError:
+                return
+
+            batch = [first]
+            deadline = loop.time() + self.max_latency
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # Sampling parameters are shared across a generate() call, so group by them
+            groups: Dict[tuple, List[_PendingRequest]] = {}
+            for request in batch:
+                groups.setdefault((request.max_new_tokens, request.temperature), []).append(request)
+
+            for (max_new_tokens, temperature), requests in groups.items():
+                await self._generate_batch(requests, max_new_tokens, temperature)
+
+    async def _generate_batch(self, requests: List[_PendingRequest], max_new_tokens: int, temperature: float):
+        """Run one padded generate() call and scatter the rows back to the waiting requests"""
+        try:
+            input_ids = self._left_pad([r.input_ids for r in requests], self.pad_token_id)
+            attention_mask = self._left_pad([r.attention_mask for r in requests], 0)
+            if len(requests) > 1:
+                logger.info(f"Batched generation: {len(requests)} requests, padded length {input_ids.size(1)}")
+
+            outputs = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._generate, input_ids, attention_mask, max_new_tokens, temperature
+            )
+
+            for row, request in zip(outputs, requests):
+                pad_length = input_ids.size(1) - request.input_ids.size(0)
+                if not request.future.done():
+                    request.future.set_result(row[pad_length:])
+        except Exception as e:
+            for request in requests:
+                if not request.future.done():
+                    request.future.set_exception(e)
+
+    def _generate(self, input_ids: torch.Tensor, attention_mask: torch.Tensor, max_new_tokens: int, temperature: float) -> torch.Tensor:
+        with torch.inference_mode():
+            return self.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                max_new_tokens=max_new_tokens,
+                **self.sampling_kwargs(temperature),
+                **self.gen_kwargs
+            )
+
+    @staticmethod
+    def _left_pad(sequences: List[torch.Tensor], padding_value: int) -> torch.Tensor:
+        """Left-pad 1-D tensors so every prompt ends at the last column (required for decoder-only generation)"""
+        flipped = [seq.flip(0) for seq in sequences]
+        return pad_sequence(flipped, batch_first=True, padding_value=padding_value).flip(1)
@@ -1,15 +1,30 @@
 import os
-import torch
+import sys
+import json
+import re
+import time
+import asyncio
 import numpy as np
-from typing import Dict, Any, Optional, List
-from pathlib import Path
-from transformers import AutoTokenizer, AutoModelForCausalLM
-from peft import PeftModel
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List, Tuple, AsyncIterator, Iterator, Callable, Awaitable, NamedTuple
 from loguru import logger
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, insert, text
+from sqlalchemy import select, insert, update, text, func
 from datetime import datetime
 
+# Hugging Face support
+try:
+    import torch
+    from transformers import (
+        AutoTokenizer, AutoModelForCausalLM, PreTrainedTokenizerBase,
+        TextIteratorStreamer, StoppingCriteria, StoppingCriteriaList,
+        LogitsProcessor, LogitsProcessorList
+    )
+    from services.batch_scheduler import BatchScheduler
+    HF_AVAILABLE = True
+except ImportError:
+    HF_AVAILABLE = False
+    logger.warning("PyTorch/Transformers not available - local model generation disabled")
+
 # Neural Engine support
 try:
     import coremltools as ct
@@ -19,16 +34,596 @@ except ImportError:
     COREML_AVAILABLE = False
     logger.warning("Core ML not available - Neural Engine features disabled")
 
+# Core ML compute units for Neural Engine models: ALL, CPU_AND_NE, CPU_AND_GPU or CPU_ONLY.
+# Use CPU_AND_GPU for models that regress on the ANE (e.g. FP16 precision issues).
+NE_COMPUTE_UNIT = os.getenv("NE_COMPUTE_UNIT", "CPU_AND_NE").upper()
+NE_WINDOW = 64  # Sequence length of fixed-shape Neural Engine exports
+NE_BENCHMARK = os.getenv("NE_BENCHMARK", "").lower() in ("1", "true", "on")  # Time every compute unit on load
+NE_MAX_NEW_TOKENS = 32
+
+def _ne_compute_units():
+    """Resolve NE_COMPUTE_UNIT to a coremltools ComputeUnit"""
+    unit = getattr(ct.ComputeUnit, NE_COMPUTE_UNIT, None)
+    if unit is None:
+        logger.warning(f"Unknown NE_COMPUTE_UNIT '{NE_COMPUTE_UNIT}', using CPU_AND_NE")
+        unit = ct.ComputeUnit.CPU_AND_NE
+    return unit
+
+# Weight quantization for Neural Engine models: "int8" (per-channel) or "int4" (per-block, iOS 18 /
+# macOS 15 and later) creates <name>.<dtype>.mlpackage next to the exported FP16 package on first load.
+# Existing quantized packages are always preferred, smallest weights first.
+NE_QUANTIZE = os.getenv("NE_QUANTIZE", "off").lower()
+NE_QUANTIZED_DTYPES = ("int4", "int8")
+
+def _ne_quantized_path(model_path: str, dtype: str) -> str:
+    return model_path.replace(".mlpackage", f".{dtype}.mlpackage")
+
+def _ne_load_path(model_path: str) -> str:
+    """Pick the quantized variant of a Neural Engine package if one exists"""
+    for dtype in NE_QUANTIZED_DTYPES:
+        quantized_path = _ne_quantized_path(model_path, dtype)
+        if os.path.exists(quantized_path):
+            return quantized_path
+    return model_path
+
+def _quantize_ne_model(model_path: str, dtype: str, quantized_path: str):
+    """One-time linear weight quantization of an FP16 .mlpackage (halves/quarters size and bandwidth cost)"""
+    import coremltools.optimize.coreml as cto
+    if dtype == "int4":
+        op_config = cto.OpLinearQuantizerConfig(
+            mode="linear_symmetric", dtype="int4", granularity="per_block", block_size=32
+        )
+    else:
+        op_config = cto.OpLinearQuantizerConfig(
+            mode="linear_symmetric", dtype="int8", granularity="per_channel"
+        )
+    mlmodel = ct.models.MLModel(model_path, skip_model_load=True)
+    cto.linear_quantize_weights(mlmodel, config=cto.OptimizationConfig(global_config=op_config)).save(quantized_path)
+
+# Aho-Corasick keyword matching (optional, falls back to substring scan)
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
 from database.database import AsyncSessionLocal
+from services.model_cache import LRUModelCache
 from models.database_models import ChatSession, ChatMessage, TrainingJob, ChatMessageRole
 from models.schemas import ChatSessionCreate, ChatSessionResponse, ChatMessageResponse, ChatGenerateRequest, ChatGenerateResponse
 
+# Response cleanup patterns, compiled once
+_STOP_RE = re.compile(r"User:|<\|endoftext\|>")
+_PREFIX_RE = re.compile(r"^(?:Bot|Assistant|AI|Response|Reply):\s*")
+_PUNCT_TABLE = str.maketrans("", "", " .,")
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uff00-\uffef]")
+
+def _clip_prompt(prompt: str, max_tokens: int) -> str:
+    """Keep only the tail of the prompt that can fit in max_tokens, so BPE never runs over discarded text"""
+    # ~4 chars per token for Latin text, ~1-2 for Japanese/CJK (SentencePiece)
+    chars_per_token = 2 if _CJK_RE.search(prompt) else 4
+    return prompt[-chars_per_token * max_tokens:]
+
+
+# Top-k cutoff that generate() applied implicitly before sampling was fused (GenerationConfig default)
+DEFAULT_TOP_K = 50
+# Stop markers for the fine-tuned chat format, matched at the token-id level
+STOP_SEQUENCES = ("User:", " User:", "<|endoftext|>")
+
+
+class PromptTemplate(NamedTuple):
+    """Prompt layout: prefix + separator + prompt + suffix; generation is cut at stop_sequences"""
+    prefix: str
+    separator: str
+    suffix: str
+    stop_sequences: Tuple[str, ...] = ()
+
+
+# Fine-tuned models: matches the training data format "User: {prompt} Bot:"
+FINE_TUNED_TEMPLATE = PromptTemplate("User:", " ", " Bot:", STOP_SEQUENCES)
+# rinna instruction models expect "ユーザー: <prompt><NL>システム: "
+RINNA_TEMPLATE = PromptTemplate("ユーザー:", " ", "<NL>システム: ", ("ユーザー:",))
+# Plain HF models: the prompt as-is
+HF_TEMPLATE = PromptTemplate("", "", "", ("User:", "Human:"))
+
+
+def _truncate_at_stop(token_ids: List[int], stop_sequences: List[List[int]]) -> List[int]:
+    """Cut token ids at the first occurrence of any stop sequence"""
+    cut = len(token_ids)
+    for stop in stop_sequences:
+        length = len(stop)
+        if not length:
+            continue
+        first = stop[0]
+        for i in range(min(cut, len(token_ids) - length + 1)):
+            if token_ids[i] == first and token_ids[i:i + length] == stop:
+                cut = i
+                break
+    return token_ids[:cut]
+
+# Streamed text is held back by this many characters so a stop marker split across chunks is never emitted
+_STREAM_HOLDBACK = len("<|endoftext|>")
+
+
+async def _aiter(iterator: Iterator[str]) -> AsyncIterator[str]:
+    """Iterate a blocking iterator (e.g. TextIteratorStreamer) without blocking the event loop"""
+    sentinel = object()
+    while True:
+        item = await asyncio.to_thread(next, iterator, sentinel)
+        if item is sentinel:
+            return
+        yield item
+
+
+_copy_stream = None
+
+def _to_device(inputs, device: str):
+    """Move tokenized inputs to the device; CUDA copies go through pinned memory without blocking the host"""
+    global _copy_stream
+    if device != "cuda":
+        return inputs  # Tokenizer output already lives on the CPU
+    
+    # Copies run on a side stream so they overlap with a generate() already running on the default stream
+    if _copy_stream is None:
+        _copy_stream = torch.cuda.Stream()
+    with torch.cuda.stream(_copy_stream):
+        moved = {key: value.pin_memory().to(device, non_blocking=True) for key, value in inputs.items()}
+    compute_stream = torch.cuda.default_stream()
+    compute_stream.wait_stream(_copy_stream)  # generate() on the default stream sees finished copies
+    for value in moved.values():
+        value.record_stream(compute_stream)  # Keep the allocator from reusing the memory too early
+    return moved
+
+
+if HF_AVAILABLE:
+    class _StopFlag(StoppingCriteria):
+        """Stops a running generate() once the streaming consumer has seen enough"""
+
+        def __init__(self):
+            self.stopped = False
+
+        def __call__(self, input_ids, scores, **kwargs) -> bool:
+            return self.stopped
+
+    class _StopOnSequences(StoppingCriteria):
+        """Per-row stop once the generated tail ends with a stop sequence (e.g. the next role marker)"""
+
+        def __init__(self, stop_sequences: List[List[int]]):
+            self.stop_sequences = [stop for stop in stop_sequences if stop]
+            self.prompt_length: Optional[int] = None
+
+        def __call__(self, input_ids, scores, **kwargs) -> "torch.BoolTensor":
+            if self.prompt_length is None:
+                # First call happens after the first new token; one instance per generate() call
+                self.prompt_length = input_ids.shape[1] - 1
+            generated = input_ids.shape[1] - self.prompt_length
+            done = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+            for stop in self.stop_sequences:
+                if len(stop) <= generated:
+                    tail = torch.tensor(stop, device=input_ids.device)
+                    done |= (input_ids[:, -len(stop):] == tail).all(dim=1)
+            return done
+
+    class _FusedSamplingProcessor(LogitsProcessor):
+        """Repetition penalty + temperature + top-k + top-p in one processor, updating the logits row in place"""
+        
+        def __init__(self, temperature: float, repetition_penalty: float, top_p: float, top_k: int = DEFAULT_TOP_K):
+            self.temperature = max(temperature, 1e-5)  # temperature=0 would divide by zero
+            self.repetition_penalty = repetition_penalty
+            self.top_p = top_p
+            self.top_k = top_k
+
+        def __call__(self, input_ids: "torch.LongTensor", scores: "torch.FloatTensor") -> "torch.FloatTensor":
+            # Penalize already generated ids (same rule as RepetitionPenaltyLogitsProcessor)
+            seen = scores.gather(1, input_ids)
+            seen = torch.where(seen < 0, seen * self.repetition_penalty, seen / self.repetition_penalty)
+            scores.scatter_(1, input_ids, seen)
+            scores.div_(self.temperature)
+            
+            if self.top_k > 0:
+                kth_best = scores.topk(min(self.top_k, scores.size(-1)), dim=-1).values[:, -1:]
+                scores.masked_fill_(scores < kth_best, -float("inf"))
+            
+            # Nucleus filtering: drop the low-probability tail whose mass is <= 1 - top_p
+            sorted_scores, sorted_indices = scores.sort(dim=-1)
+            tail = sorted_scores.softmax(dim=-1).cumsum(dim=-1) <= (1 - self.top_p)
+            tail[:, -1] = False  # Always keep the most likely token
+            return scores.masked_fill_(tail.scatter(1, sorted_indices, tail), -float("inf"))
+
+
+# Fallback responses for the fine-tuned model when generation yields nothing usable
+FALLBACK_RESPONSES = {
+    "おはよう": "おはようございます！",
+    "こんにちは": "こんにちは！",
+    "こんばんは": "こんばんは！",
+    "ありがとう": "どういたしまして。",
+    "元気": "はい、元気です！",
+    "天気": "今日はいい天気ですね。",
+    "さようなら": "さようなら、また会いましょう。"
+}
+
+# 基本的な日本語応答パターン（モデル読み込み不要）
+SIMPLE_JAPANESE_RESPONSES = {
+    "こんにちは": "こんにちは！今日はいかがお過ごしですか？",
+    "こんばんは": "こんばんは！お疲れ様でした。今夜もよろしくお願いします。",
+    "おはよう": "おはようございます！今日も一日頑張りましょう。",
+    "ありがとう": "どういたしまして。お役に立てて嬉しいです。",
+    "元気": "はい、元気です！ありがとうございます。あなたはいかがですか？",
+    "天気": "今日は良い天気ですね。外出日和だと思います。",
+    "さようなら": "さようなら。また会いましょう！",
+    "はじめまして": "はじめまして！よろしくお願いします。",
+    "お疲れ": "お疲れ様でした！ゆっくり休んでくださいね。",
+    "こんにちわ": "こんにちは！お元気ですか？",
+    "テスト": "テスト応答です。rinna-3.6bモデルシミュレーションが動作しています。",
+    "Neural Engine": "Neural Engineシミュレーションモードで動作中です。",
+}
+
+class KeywordResponseTable:
+    """Keyword -> canned response lookup where the earliest keyword in table order wins"""
+
+    def __init__(self, responses: Dict[str, str]):
+        self._entries = list(responses.items())
+        self._automaton = None
+        if AHOCORASICK_AVAILABLE:
+            # Single linear pass over the prompt instead of one substring search per key
+            self._automaton = ahocorasick.Automaton()
+            for index, key in enumerate(responses):
+                self._automaton.add_word(key, index)
+            self._automaton.make_automaton()
+
+    def match(self, prompt: str) -> Optional[Tuple[str, str]]:
+        """Return the (keyword, response) pair for the prompt, or None if nothing matches"""
+        if self._automaton is not None:
+            index = min((i for _, i in self._automaton.iter(prompt)), default=None)
+            return None if index is None else self._entries[index]
+        for key, value in self._entries:
+            if key in prompt:
+                return key, value
+        return None
+
+# 空応答時のフォールバック（HF/Neural Engine共通、rinnaは会話調）
+MODEL_FALLBACK_RESPONSES = {
+    "こんにちは": "こんにちは！元気ですか？",
+    "元気": "はい、元気です！ありがとうございます。",
+    "ありがとう": "どういたしまして。",
+    "天気": "今日は良い天気ですね。",
+}
+
+RINNA_FALLBACK_RESPONSES = {
+    "こんにちは": "こんにちは！今日はどのようなことについてお話ししましょうか？",
+    "おはよう": "おはようございます！今日も一日よろしくお願いします。",
+    "元気": "はい、元気です！ありがとうございます。あなたはいかがですか？",
+    "ありがとう": "どういたしまして。他にもお手伝いできることがあれば教えてください。",
+}
+
+_FALLBACK_TABLE = KeywordResponseTable(FALLBACK_RESPONSES)
+_SIMPLE_JAPANESE_TABLE = KeywordResponseTable(SIMPLE_JAPANESE_RESPONSES)
+_MODEL_FALLBACK_TABLE = KeywordResponseTable(MODEL_FALLBACK_RESPONSES)
+_RINNA_FALLBACK_TABLE = KeywordResponseTable(RINNA_FALLBACK_RESPONSES)
+
+def _fallback_response(table: KeywordResponseTable, prompt: str, default: str) -> str:
+    match = table.match(prompt)
+    return match[1] if match else default
+
+# Weight quantization for fine-tuned chat models: int8, nf4 or off.
+# bitsandbytes needs CUDA; on CPU any setting other than off uses dynamic int8 quantization.
+LLMLORA_QUANT = os.getenv("LLMLORA_QUANT", "off").lower()
+# torch.compile the fine-tuned model's forward on load (compile cost is paid once per cached model)
+LLMLORA_COMPILE = os.getenv("LLMLORA_COMPILE", "off").lower() in ("1", "true", "on")
+
+# HuggingFace base models are several GB each, keep fewer of them
+MAX_CACHED_HF_MODELS = 2
+# Threads for blocking generate()/predict() calls so they never run on the event loop
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", str(os.cpu_count() or 1)))
+# Micro-batching window: requests arriving within BATCH_LATENCY_MS share one generate() call
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "8"))
+BATCH_LATENCY_MS = float(os.getenv("BATCH_LATENCY_MS", "10"))
+SESSION_CACHE_TTL = 30.0  # seconds
+MAX_CACHED_SESSIONS = 256
+
 class ChatService:
     def __init__(self):
-        self.model_cache = {}  # Cache for loaded models
-        self.tokenizer_cache = {}  # Cache for tokenizers
-        self.neural_engine_cache = {}  # Cache for Neural Engine models
-        self.neural_engine_tokenizer_cache = {}  # Cache for NE tokenizers
+        self.model_cache = LRUModelCache()  # Cache for loaded models
+        self.tokenizer_cache = LRUModelCache()  # Cache for tokenizers
+        self.neural_engine_cache = LRUModelCache()  # Cache for Neural Engine models
+        self.neural_engine_tokenizer_cache = LRUModelCache()  # Cache for NE tokenizers
+        self.shared_tokenizer_cache = LRUModelCache()  # Tokenizers keyed by path, shared across load paths
+        self.hf_model_cache = LRUModelCache()  # model_name -> (model, tokenizer) for HF/rinna models
+        self._hf_load_lock = asyncio.Lock()  # Prevents concurrent duplicate HF model loads
+        self.batch_schedulers = LRUModelCache()  # generation key -> BatchScheduler
+        self._ne_available_cache: Dict[int, Tuple[float, bool]] = {}  # job_id -> (mtime, loadable)
+        self.stop_token_ids: Dict[str, List[List[int]]] = {}  # generation key -> tokenized stop sequences
+        self.prompt_affix_ids: Dict[str, Tuple[List[int], List[int]]] = {}  # generation key -> (prefix ids, suffix ids)
+        self._session_cache: Dict[int, Tuple[ChatSession, float]] = {}  # session_id -> (session, expires_at)
+        self._gen_pool = ThreadPoolExecutor(max_workers=GENERATION_WORKERS, thread_name_prefix="generate")
+
+    def _get_tokenizer(self, path: str, **kwargs) -> "PreTrainedTokenizerBase":
+        """Load a tokenizer once per path and share it between the PEFT, HF and Neural Engine paths"""
+        if path in self.shared_tokenizer_cache:
+            return self.shared_tokenizer_cache[path]
+        
+        kwargs.setdefault("use_fast", True)
+        try:
+            tokenizer = AutoTokenizer.from_pretrained(path, **kwargs)
+        except (ValueError, OSError, ImportError) as e:
+            if not kwargs["use_fast"]:
+                raise
+            # Only models that genuinely lack a fast (Rust) tokenizer fall back to the slow one
+            logger.warning(f"Fast tokenizer unavailable for {path}, falling back to slow tokenizer: {e}")
+            kwargs["use_fast"] = False
+            tokenizer = AutoTokenizer.from_pretrained(path, **kwargs)
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        self.shared_tokenizer_cache.put(path, tokenizer)
+        return tokenizer
+
+    def _get_batch_scheduler(
+        self,
+        key: str,
+        model,
+        tokenizer,
+        repetition_penalty: float,
+        top_p: float,
+        top_k: int = DEFAULT_TOP_K
+    ) -> "BatchScheduler":
+        """Get the micro-batching scheduler for a model, recreating it if the model was reloaded"""
+        if key in self.batch_schedulers and self.batch_schedulers[key].model is model:
+            return self.batch_schedulers[key]
+        
+        gen_kwargs = self._core_gen_kwargs(tokenizer)
+        scheduler = BatchScheduler(
+            model,
+            pad_token_id=gen_kwargs["pad_token_id"],
+            gen_kwargs=gen_kwargs,
+            max_batch=MAX_BATCH_SIZE,
+            max_latency_ms=BATCH_LATENCY_MS,
+            sampling_kwargs=lambda temperature: {
+                **self._sampling_kwargs(temperature, repetition_penalty, top_p, top_k),
+                **self._stop_kwargs(key)
+            },
+            executor=self._gen_pool
+        )
+        self.batch_schedulers.put(key, scheduler)
+        return scheduler
+    
+    def _stop_kwargs(self, key: str) -> Dict[str, Any]:
+        """Fresh per-call stopping criteria so rows end at a stop sequence instead of running to max_new_tokens"""
+        stop_ids = self.stop_token_ids.get(key)
+        if not stop_ids:
+            return {}
+        return {"stopping_criteria": StoppingCriteriaList([_StopOnSequences(stop_ids)])}
+    
+    @staticmethod
+    def _sync_generate(model, inputs, gen_kwargs: Dict[str, Any]) -> "torch.Tensor":
+        """Blocking generate() call, run on the generation thread pool"""
+        with torch.inference_mode():
+            return model.generate(
+                input_ids=inputs["input_ids"],
+                attention_mask=inputs["attention_mask"],
+                **gen_kwargs
+            )
+    
+    @staticmethod
+    def _core_gen_kwargs(tokenizer) -> Dict[str, Any]:
+        """generate() settings shared by every local model path"""
+        return dict(
+            min_new_tokens=1,  # Allow short responses
+            do_sample=True,
+            pad_token_id=tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id,
+            eos_token_id=tokenizer.eos_token_id,
+            num_beams=1,
+            use_cache=True
+        )
+    
+    @staticmethod
+    def _sampling_kwargs(temperature: float, repetition_penalty: float, top_p: float, top_k: int = DEFAULT_TOP_K) -> Dict[str, Any]:
+        """Sampling as one fused logits pass; the built-in warpers are disabled"""
+        return dict(
+            logits_processor=LogitsProcessorList([
+                _FusedSamplingProcessor(temperature, repetition_penalty, top_p, top_k)
+            ]),
+            temperature=1.0,
+            top_p=1.0,
+            top_k=0,
+            repetition_penalty=1.0
+        )
+    
+    def _build_prompt_inputs(
+        self,
+        key: str,
+        tokenizer,
+        text: str,
+        device: str,
+        max_length: int = 512
+    ) -> Dict[str, "torch.Tensor"]:
+        """Build input_ids/attention_mask around text from the cached prefix/suffix ids"""
+        # Only the prompt is tokenized here; the constant prefix/suffix ids are cached per key
+        prefix_ids, suffix_ids = self.prompt_affix_ids[key]
+        prompt_ids = tokenizer.encode(
+            text,
+            add_special_tokens=False,
+            truncation=True,
+            max_length=max_length - len(prefix_ids) - len(suffix_ids)
+        )
+        input_ids = torch.tensor([prefix_ids + prompt_ids + suffix_ids])
+        return _to_device({"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}, device)
+    
+    @staticmethod
+    def _adds_bos(tokenizer) -> bool:
+        """Whether encode() with special tokens starts the sequence with the BOS token"""
+        return tokenizer.bos_token_id is not None and tokenizer.encode("x")[:1] == [tokenizer.bos_token_id]
+    
+    async def _prepare_core(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Tuple[Any, Any]]],
+        template: PromptTemplate,
+        prompt: str,
+        max_length: int = 512
+    ):
+        """Load (or reuse) a model and tokenize the prompt with its template"""
+        model, tokenizer = await loader()
+        
+        if key not in self.prompt_affix_ids:
+            # Affixes are encoded without special tokens (T5Tokenizer would append </s> mid-prompt);
+            # BOS is prepended explicitly only for tokenizers that add it to a normal encode
+            bos = [tokenizer.bos_token_id] if self._adds_bos(tokenizer) else []
+            self.prompt_affix_ids[key] = (
+                bos + tokenizer.encode(template.prefix, add_special_tokens=False),
+                tokenizer.encode(template.suffix, add_special_tokens=False)
+            )
+            self.stop_token_ids[key] = [
+                tokenizer.encode(stop, add_special_tokens=False) for stop in template.stop_sequences
+            ]
+        
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        prompt = _clip_prompt(prompt, max_length)  # truncation=True stays as the exact safety net
+        # Tokenizing long prompts takes tens of ms; keep it off the event loop
+        inputs = await asyncio.to_thread(
+            self._build_prompt_inputs, key, tokenizer, template.separator + prompt, device, max_length
+        )
+        logger.debug("Input token shape: {}, device: {}", inputs["input_ids"].shape, device)
+        return model, tokenizer, inputs
+    
+    async def _generate_core(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Tuple[Any, Any]]],
+        template: PromptTemplate,
+        prompt: str,
+        temperature: float,
+        max_new_tokens: int,
+        repetition_penalty: float,
+        top_p: float,
+        top_k: int = DEFAULT_TOP_K,
+        max_length: int = 512
+    ) -> str:
+        """Shared load -> tokenize -> batched generate -> decode path for every local model"""
+        model, tokenizer, inputs = await self._prepare_core(key, loader, template, prompt, max_length)
+        
+        # Concurrent requests for the same model are coalesced into one generate() call
+        scheduler = self._get_batch_scheduler(key, model, tokenizer, repetition_penalty, top_p, top_k)
+        output_ids = await scheduler.submit(
+            inputs["input_ids"][0],
+            inputs["attention_mask"][0],
+            max_new_tokens=max_new_tokens,
+            temperature=temperature
+        )
+        
+        input_length = inputs["input_ids"].size(1)
+        out_len = output_ids.size(0)
+        logger.debug("Input length: {}, Output length: {}", input_length, out_len)
+        
+        # Full decode only happens when debug logging is enabled
+        logger.opt(lazy=True).debug(
+            "Full generated output: '{}'",
+            lambda: tokenizer.decode(output_ids, skip_special_tokens=True)
+        )
+        
+        if out_len <= input_length:
+            logger.warning("No new tokens generated!")
+            return ""
+        
+        # Extract only the new tokens (response part), cut at stop sequences before decoding once
+        response_tokens = _truncate_at_stop(output_ids[input_length:].tolist(), self.stop_token_ids[key])
+        response = await asyncio.to_thread(tokenizer.decode, response_tokens, skip_special_tokens=True)
+        return response.strip()
+    
+    async def _get_or_load_fine_tuned(self, model_path: str, job_id: int):
+        """Return (model, tokenizer) for a fine-tuned job, loading it on first use"""
+        if job_id not in self.model_cache:
+            await self._load_model(model_path, job_id)
+        return self.model_cache[job_id], self.tokenizer_cache[job_id]
+
+    async def _get_session(self, db, session_id: int) -> Optional[ChatSession]:
+        """Return a ChatSession from the short-lived cache, falling back to a primary-key lookup"""
+        cached = self._session_cache.get(session_id)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+
+        session = await db.get(ChatSession, session_id)
+        if session:
+            self._session_cache.pop(session_id, None)
+            self._session_cache[session_id] = (session, time.monotonic() + SESSION_CACHE_TTL)
+            if len(self._session_cache) > MAX_CACHED_SESSIONS:
+                self._session_cache.pop(next(iter(self._session_cache)))
+        return session
+
+    def invalidate_session(self, session_id: int):
+        """Drop a cached ChatSession after it has been modified or deleted"""
+        self._session_cache.pop(session_id, None)
+
+    async def _get_or_load_hf(self, model_name: str, hf_token: Optional[str] = None, use_fast: bool = True):
+        """Return a cached (model, tokenizer) pair for a HuggingFace model, loading it at most once"""
+        if model_name in self.hf_model_cache:
+            return self.hf_model_cache[model_name]
+        
+        async with self._hf_load_lock:
+            # Another request may have finished loading while we waited for the lock
+            if model_name in self.hf_model_cache:
+                return self.hf_model_cache[model_name]
+            
+            logger.info(f"Loading HuggingFace model: {model_name}")
+            
+            # タイムアウト付きでtokenizer読み込み
+            try:
+                tokenizer = await asyncio.wait_for(
+                    asyncio.to_thread(
+                        self._get_tokenizer,
+                        model_name,
+                        token=hf_token,
+                        trust_remote_code=True,
+                        use_fast=use_fast
+                    ),
+                    timeout=30.0
+                )
+            except asyncio.TimeoutError:
+                logger.error(f"❌ Tokenizer loading timeout for {model_name}")
+                raise TimeoutError("Tokenizer loading timeout")
+            
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            dtype = torch.float16 if device == "cuda" else torch.float32
+            load_kwargs = dict(
+                token=hf_token,
+                torch_dtype=dtype,
+                device_map="auto" if device == "cuda" else None,
+                trust_remote_code=True
+            )
+            
+            # タイムアウト付きでモデル読み込み
+            try:
+                # Fused scaled-dot-product attention (SDPA) kernels for faster decode
+                try:
+                    model = await asyncio.wait_for(
+                        asyncio.to_thread(
+                            AutoModelForCausalLM.from_pretrained,
+                            model_name,
+                            attn_implementation="sdpa",
+                            **load_kwargs
+                        ),
+                        timeout=60.0
+                    )
+                except (ValueError, ImportError) as e:
+                    logger.warning(f"SDPA attention not supported for {model_name}, using default attention: {e}")
+                    model = await asyncio.wait_for(
+                        asyncio.to_thread(AutoModelForCausalLM.from_pretrained, model_name, **load_kwargs),
+                        timeout=60.0
+                    )
+            except asyncio.TimeoutError:
+                logger.error(f"❌ Model loading timeout for {model_name}")
+                raise TimeoutError("Model loading timeout")
+            
+            if device == "cpu":
+                model = model.to(device)
+            
+            if LLMLORA_COMPILE:
+                self._enable_static_cache(model, device)
+            
+            await asyncio.get_running_loop().run_in_executor(self._gen_pool, self._warmup, model, tokenizer, device)
+            
+            self.hf_model_cache.put(model_name, (model, tokenizer), max_items=MAX_CACHED_HF_MODELS)
+            logger.info(f"✅ HuggingFace model loaded successfully: {model_name}")
+            return model, tokenizer
         
     async def create_session(self, session_data: ChatSessionCreate) -> ChatSessionResponse:
         """Create a new chat session"""
@@ -37,8 +632,7 @@ class ChatService:
             
             # Handle fine-tuned model (training job)
             if session_data.job_id:
-                result = await db.execute(select(TrainingJob).where(TrainingJob.id == session_data.job_id))
-                job = result.scalar_one_or_none()
+                job = await db.get(TrainingJob, session_data.job_id)
                 
                 if not job:
                     raise ValueError(f"Training job {session_data.job_id} not found")
@@ -51,10 +645,9 @@ class ChatService:
             # Handle Ollama model
             elif session_data.model_name:
                 # Verify Ollama model exists
-                from services.ollama_service import OllamaService
-                async with OllamaService() as ollama:
-                    if not await ollama.check_model_exists(session_data.model_name):
-                        raise ValueError(f"Ollama model {session_data.model_name} not found")
+                from services.ollama_service import ollama_service
+                if not await ollama_service.check_model_exists(session_data.model_name):
+                    raise ValueError(f"Ollama model {session_data.model_name} not found")
             
             else:
                 raise ValueError("Either job_id or model_name must be provided")
@@ -83,10 +676,16 @@ class ChatService:
                 updated_at=new_session.updated_at
             )
     
-    async def get_sessions(self) -> List[ChatSessionResponse]:
-        """Get all chat sessions"""
+    async def get_sessions(self, limit: Optional[int] = None, offset: int = 0) -> List[ChatSessionResponse]:
+        """Get chat sessions, most recently updated first (all of them unless limit is given)"""
         async with AsyncSessionLocal() as db:
-            result = await db.execute(select(ChatSession))
+            # updated_at is bumped by _save_turn, so this is ordered by the latest message
+            result = await db.execute(
+                select(ChatSession)
+                .order_by(ChatSession.updated_at.desc(), ChatSession.id.desc())
+                .limit(limit)
+                .offset(offset)
+            )
             sessions = result.scalars().all()
             
             return [
@@ -103,15 +702,18 @@ class ChatService:
                 for session in sessions
             ]
     
-    async def get_session_messages(self, session_id: int) -> List[ChatMessageResponse]:
-        """Get all messages for a chat session"""
+    async def get_session_messages(self, session_id: int, limit: Optional[int] = None, offset: int = 0) -> List[ChatMessageResponse]:
+        """Get the latest messages for a chat session (all unless limit is given; offset counts back from the newest), oldest first"""
         async with AsyncSessionLocal() as db:
+            # Served by the (session_id, timestamp) index instead of sorting the whole history
             result = await db.execute(
                 select(ChatMessage)
                 .where(ChatMessage.session_id == session_id)
-                .order_by(ChatMessage.timestamp)
+                .order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+                .limit(limit)
+                .offset(offset)
             )
-            messages = result.scalars().all()
+            messages = reversed(result.scalars().all())
             
             return [
                 ChatMessageResponse(
@@ -126,110 +728,205 @@ class ChatService:
     
     async def generate_response(self, request: ChatGenerateRequest) -> ChatGenerateResponse:
         """Generate a response using the fine-tuned model"""
+        # Get session (cached for a short TTL); the connection is released before generation starts
+        async with AsyncSessionLocal() as db:
+            session = await self._get_session(db, request.session_id)
+        
+        if not session:
+            raise ValueError(f"Chat session {request.session_id} not found")
+        
+        try:
+            response_text = await self._generate_for_session(session, request)
+        except Exception as e:
+            logger.error(f"Error generating response: {e}")
+            # Save error message for user
+            response_text = "エラーが発生しました。"
+        
+        assistant_id = await self._save_turn(request.session_id, request.message, response_text)
+        
+        return ChatGenerateResponse(
+            message_id=assistant_id,
+            response=response_text,
+            session_id=request.session_id
+        )
+    
+    async def stream_response(self, request: ChatGenerateRequest) -> AsyncIterator[str]:
+        """Validate the session and return an async iterator of response text chunks"""
         async with AsyncSessionLocal() as db:
-            # Get session
-            result = await db.execute(select(ChatSession).where(ChatSession.id == request.session_id))
-            session = result.scalar_one_or_none()
-            
-            if not session:
-                raise ValueError(f"Chat session {request.session_id} not found")
-            
-            # Save user message
-            user_message = ChatMessage(
-                session_id=request.session_id,
-                role=ChatMessageRole.USER,
-                content=request.message
+            session = await self._get_session(db, request.session_id)
+        
+        if not session:
+            raise ValueError(f"Chat session {request.session_id} not found")
+        
+        return self._stream_turn(session, request)
+    
+    async def _stream_turn(self, session: ChatSession, request: ChatGenerateRequest) -> AsyncIterator[str]:
+        """Yield response chunks, then save the turn once the full response is known"""
+        chunks: List[str] = []
+        try:
+            if session.model_name:  # Ollama model
+                async for chunk in self._stream_with_ollama(
+                    session.model_name,
+                    request.message,
+                    temperature=request.temperature,
+                    max_tokens=request.max_tokens
+                ):
+                    chunks.append(chunk)
+                    yield chunk
+                if not "".join(chunks).strip():
+                    chunks = ["申し訳ございませんが、応答を生成できませんでした。"]
+                    yield chunks[0]
+            elif HF_AVAILABLE and not (session.job_id and self.is_neural_engine_available(session.job_id)):
+                async for chunk in self._stream_with_model(
+                    session.model_path,
+                    session.job_id,
+                    request.message,
+                    temperature=request.temperature,
+                    max_tokens=request.max_tokens
+                ):
+                    chunks.append(chunk)
+                    yield chunk
+            else:
+                # The Neural Engine path produces the whole response at once
+                chunks.append(await self._generate_for_session(session, request))
+                yield chunks[-1]
+        except Exception as e:
+            logger.error(f"Error streaming response: {e}")
+            chunks = ["エラーが発生しました。"]
+            yield chunks[0]
+        
+        await self._save_turn(request.session_id, request.message, "".join(chunks))
+    
+    async def _generate_for_session(self, session: ChatSession, request: ChatGenerateRequest) -> str:
+        """Dispatch generation to Ollama, the Neural Engine or the fine-tuned model"""
+        # Generate response based on session type
+        if session.model_name:  # Ollama model
+            return await self._generate_with_ollama(
+                session.model_name,
+                request.message,
+                temperature=request.temperature,
+                max_tokens=request.max_tokens
             )
-            db.add(user_message)
-            await db.commit()
-            await db.refresh(user_message)
-            
-            try:
-                # Generate response based on session type
-                if session.model_name:  # Ollama model
-                    response_text = await self._generate_with_ollama(
-                        session.model_name,
+        else:  # Fine-tuned model
+            # Check if Neural Engine model is available for this job
+            if session.job_id and self.is_neural_engine_available(session.job_id):
+                logger.info(f"Using Neural Engine for job {session.job_id}")
+                
+                try:
+                    # Load Neural Engine model if not cached
+                    if session.job_id not in self.neural_engine_cache:
+                        ne_model_path = f"/app/training_data/job_{session.job_id}/neural_engine_model.mlpackage"
+                        await self._load_neural_engine_model(ne_model_path, session.job_id)
+                    
+                    return await self._generate_with_neural_engine(
+                        session.job_id,
                         request.message,
                         temperature=request.temperature,
                         max_tokens=request.max_tokens
                     )
-                else:  # Fine-tuned model
-                    # Check if Neural Engine model is available for this job
-                    if session.job_id and self.is_neural_engine_available(session.job_id):
-                        logger.info(f"Using Neural Engine for job {session.job_id}")
-                        
-                        try:
-                            # Load Neural Engine model if not cached
-                            if session.job_id not in self.neural_engine_cache:
-                                ne_model_path = f"/app/training_data/job_{session.job_id}/neural_engine_model.mlpackage"
-                                await self._load_neural_engine_model(ne_model_path, session.job_id)
-                            
-                            response_text = await self._generate_with_neural_engine(
-                                session.job_id,
-                                request.message,
-                                temperature=request.temperature,
-                                max_tokens=request.max_tokens
-                            )
-                        except Exception as ne_error:
-                            logger.error(f"Neural Engine failed, falling back to PEFT model: {ne_error}")
-                            # Fallback to traditional fine-tuned model
-                            response_text = await self._generate_with_model(
-                                session.model_path,
-                                session.job_id,
-                                request.message,
-                                temperature=request.temperature,
-                                max_tokens=request.max_tokens
-                            )
-                    else:
-                        # Use traditional fine-tuned model
-                        logger.info(f"Using traditional PEFT model for job {session.job_id}")
-                        response_text = await self._generate_with_model(
-                            session.model_path,
-                            session.job_id,
-                            request.message,
-                            temperature=request.temperature,
-                            max_tokens=request.max_tokens
-                        )
-                
-                # Save assistant message
-                assistant_message = ChatMessage(
-                    session_id=request.session_id,
-                    role=ChatMessageRole.ASSISTANT,
-                    content=response_text
-                )
-                db.add(assistant_message)
-                await db.commit()
-                await db.refresh(assistant_message)
-                
-                return ChatGenerateResponse(
-                    message_id=assistant_message.id,
-                    response=response_text,
-                    session_id=request.session_id
-                )
-                
-            except Exception as e:
-                logger.error(f"Error generating response: {e}")
-                # Save error message for user
-                error_message = ChatMessage(
-                    session_id=request.session_id,
-                    role=ChatMessageRole.ASSISTANT,
-                    content="エラーが発生しました。"
-                )
-                db.add(error_message)
-                await db.commit()
-                await db.refresh(error_message)
-                
-                return ChatGenerateResponse(
-                    message_id=error_message.id,
-                    response="エラーが発生しました。",
-                    session_id=request.session_id
+                except Exception as ne_error:
+                    logger.error(f"Neural Engine failed, falling back to PEFT model: {ne_error}")
+                    # Fallback to traditional fine-tuned model
+                    return await self._generate_with_model(
+                        session.model_path,
+                        session.job_id,
+                        request.message,
+                        temperature=request.temperature,
+                        max_tokens=request.max_tokens
+                    )
+            else:
+                # Use traditional fine-tuned model
+                logger.info(f"Using traditional PEFT model for job {session.job_id}")
+                return await self._generate_with_model(
+                    session.model_path,
+                    session.job_id,
+                    request.message,
+                    temperature=request.temperature,
+                    max_tokens=request.max_tokens
                 )
     
+    async def _save_turn(self, session_id: int, user_message: str, response_text: str) -> int:
+        """Atomically save the user and assistant messages in one INSERT ... RETURNING, return the assistant id"""
+        # One short transaction per turn: both rows (or user + error message) commit together or not at all
+        async with AsyncSessionLocal() as db, db.begin():
+            result = await db.execute(
+                insert(ChatMessage)
+                .values([
+                    {"session_id": session_id, "role": ChatMessageRole.USER, "content": user_message},
+                    {"session_id": session_id, "role": ChatMessageRole.ASSISTANT, "content": response_text}
+                ])
+                .returning(ChatMessage.id, ChatMessage.role)
+            )
+            assistant_id = next(row.id for row in result.all() if row.role == ChatMessageRole.ASSISTANT)
+            # Keeps the session list ordered by recent activity
+            await db.execute(
+                update(ChatSession).where(ChatSession.id == session_id).values(updated_at=func.now())
+            )
+            return assistant_id
+    
+    async def _stream_with_model(
+        self,
+        model_path: str,
+        job_id: int,
+        prompt: str,
+        temperature: float = 0.7,
+        max_tokens: int = 512
+    ) -> AsyncIterator[str]:
+        """Stream response text from the fine-tuned model while generate() is still running"""
+        model, tokenizer, inputs = await self._prepare_core(
+            f"job:{job_id}",
+            lambda: self._get_or_load_fine_tuned(model_path, job_id),
+            FINE_TUNED_TEMPLATE,
+            prompt
+        )
+        
+        # Streaming is per request, so this path bypasses the batch scheduler
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=120.0)
+        stop_flag = _StopFlag()
+        
+        gen_kwargs = dict(
+            max_new_tokens=min(max_tokens, 150),
+            streamer=streamer,
+            stopping_criteria=StoppingCriteriaList([stop_flag]),
+            **self._core_gen_kwargs(tokenizer),
+            **self._sampling_kwargs(max(min(temperature, 0.8), 0.3), repetition_penalty=1.1, top_p=0.8)
+        )
+        generation = asyncio.get_running_loop().run_in_executor(
+            self._gen_pool, self._sync_generate, model, inputs, gen_kwargs
+        )
+        text = ""
+        emitted = 0
+        try:
+            async for chunk in _aiter(streamer):
+                text += chunk
+                if not emitted:
+                    # Remove common prefixes that might appear (held back until fully seen)
+                    text = _PREFIX_RE.sub("", text.lstrip(), count=1)
+                stop = _STOP_RE.search(text)
+                if stop:
+                    # Stop marker reached: flush what precedes it and cancel the rest of the generation
+                    stop_flag.stopped = True
+                    text = text[:stop.start()].rstrip()
+                    break
+                if len(text) - _STREAM_HOLDBACK > emitted:
+                    yield text[emitted:len(text) - _STREAM_HOLDBACK]
+                    emitted = len(text) - _STREAM_HOLDBACK
+            
+            text = text.rstrip()
+            if text[emitted:]:
+                yield text[emitted:]
+            elif not text:
+                match = _FALLBACK_TABLE.match(prompt)
+                yield match[1] if match else "そうですね。他に何かお話ししませんか？"
+        finally:
+            stop_flag.stopped = True
+            await generation
+    
     async def _generate_with_model(
-        self, 
-        model_path: str, 
+        self,
+        model_path: str,
         job_id: int,
-        prompt: str, 
+        prompt: str,
         temperature: float = 0.7,
         max_tokens: int = 512
     ) -> str:
@@ -237,133 +934,47 @@ class ChatService:
         try:
             logger.info(f"Starting generation for prompt: '{prompt[:50]}...'")
             
-            # Load model and tokenizer if not cached
-            if job_id not in self.model_cache:
-                await self._load_model(model_path, job_id)
-            
-            model = self.model_cache[job_id]
-            tokenizer = self.tokenizer_cache[job_id]
-            
-            # Format prompt to match training data format
-            formatted_prompt = f"User: {prompt} Bot:"
-            logger.info(f"Formatted prompt: '{formatted_prompt}'")
-            
-            inputs = tokenizer(formatted_prompt, return_tensors="pt", truncation=True, max_length=512)
-            logger.info(f"Input token shape: {inputs['input_ids'].shape}")
-            
-            # Determine device
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            inputs = {k: v.to(device) for k, v in inputs.items()}
-            logger.info(f"Using device: {device}")
-            
             # Simple generation for better Japanese responses
             actual_temp = max(min(temperature, 0.8), 0.3)  # Moderate temperature for stability
             logger.info(f"Using temperature: {actual_temp}")
             
-            with torch.no_grad():
-                outputs = model.generate(
-                    input_ids=inputs["input_ids"],
-                    attention_mask=inputs["attention_mask"],
-                    max_new_tokens=min(max_tokens, 150),  # Allow longer responses for better quality
-                    min_new_tokens=1,  # Allow short responses
-                    temperature=actual_temp,
-                    do_sample=True,
-                    top_p=0.8,  # More focused sampling
-                    pad_token_id=tokenizer.eos_token_id,
-                    eos_token_id=tokenizer.eos_token_id,
-                    repetition_penalty=1.1,  # Slight repetition penalty
-                    num_beams=1,
-                    early_stopping=True
-                )
-            
-            logger.info(f"Generated token shape: {outputs.shape}")
-            logger.info(f"Input length: {len(inputs['input_ids'][0])}, Output length: {len(outputs[0])}")
-            
-            # Decode full output first for debugging
-            full_output = tokenizer.decode(outputs[0], skip_special_tokens=True)
-            logger.info(f"Full generated output: '{full_output}'")
-            
-            # Extract only the new tokens (response part)
-            input_length = len(inputs["input_ids"][0])
-            if len(outputs[0]) > input_length:
-                response_tokens = outputs[0][input_length:]
-                response = tokenizer.decode(response_tokens, skip_special_tokens=True)
-                
-                # Clean up response - remove unwanted prefixes/suffixes
-                response = response.strip()
-                
-                # Remove "User:" if it appears (stop generation properly)
-                if "User:" in response:
-                    response = response.split("User:")[0].strip()
-                    
-                # Remove any trailing special tokens
-                if "<|endoftext|>" in response:
-                    response = response.split("<|endoftext|>")[0].strip()
-                    
-            else:
-                logger.warning("No new tokens generated!")
-                response = ""
+            response = await self._generate_core(
+                f"job:{job_id}",
+                lambda: self._get_or_load_fine_tuned(model_path, job_id),
+                FINE_TUNED_TEMPLATE,
+                prompt,
+                temperature=actual_temp,
+                max_new_tokens=min(max_tokens, 150),  # Allow longer responses for better quality
+                repetition_penalty=1.1,  # Slight repetition penalty
+                top_p=0.8  # More focused sampling
+            )
             
+            # Safety net for stop markers that tokenized differently in context
+            response = _STOP_RE.split(response, 1)[0].strip()
             logger.info(f"Cleaned response: '{response}'")
             
-            # Clean up and validate the response
-            response = response.strip()
-            
             # Remove common prefixes that might appear
-            prefixes_to_remove = ["Bot:", "Assistant:", "AI:", "Response:", "Reply:"]
-            for prefix in prefixes_to_remove:
-                if response.startswith(prefix):
-                    response = response[len(prefix):].strip()
-                    break
+            response = _PREFIX_RE.sub("", response, count=1)
             
             # Filter out responses that are clearly nonsensical
             if response and (
-                response.replace(" ", "").replace(".", "").replace(",", "").isdigit() or  # Just numbers
+                response.translate(_PUNCT_TABLE).isdigit() or  # Just numbers
                 len(response.strip()) < 1 or  # Empty
                 (len(response.strip()) == 1 and response.strip() in "!?.,;:")  # Single punctuation only
             ):
                 logger.warning(f"Filtering out low-quality response: '{response}'")
                 response = ""
             
-            # If still empty, provide more detailed logging and try alternative approach
-            if not response:
-                logger.warning("Response is empty after processing")
-                logger.info(f"Raw output tokens: {outputs[0].tolist()}")
-                logger.info(f"Input tokens: {inputs['input_ids'][0].tolist()}")
-                
-                # Try decoding with different approach
-                if len(outputs[0]) > input_length:
-                    alt_response = tokenizer.decode(outputs[0], skip_special_tokens=True)
-                    logger.info(f"Alternative full decode: '{alt_response}'")
-                    
-                    # Extract everything after the Bot: marker
-                    if "Bot:" in alt_response:
-                        response = alt_response.split("Bot:")[-1].strip()
-                        logger.info(f"Extracted after Bot marker: '{response}'")
-                
-                # Final fallback if still empty or inappropriate
-                if not response or "User:" in response or "I have no idea" in response:
-                    logger.warning("Using Japanese fallback response")
-                    # Simple Japanese responses based on common patterns
-                    simple_responses = {
-                        "おはよう": "おはようございます！",
-                        "こんにちは": "こんにちは！",
-                        "こんばんは": "こんばんは！",
-                        "ありがとう": "どういたしまして。",
-                        "元気": "はい、元気です！",
-                        "天気": "今日はいい天気ですね。",
-                        "さようなら": "さようなら、また会いましょう。"
-                    }
-                    
-                    # Find matching response
-                    for key, fallback_response in simple_responses.items():
-                        if key in prompt:
-                            response = fallback_response
-                            logger.info(f"Using fallback response for '{key}': '{response}'")
-                            break
-                    
-                    if not response:
-                        response = "そうですね。他に何かお話ししませんか？"
+            # Final fallback if still empty or inappropriate
+            if not response or "I have no idea" in response:
+                logger.warning("Using Japanese fallback response")
+                # Simple Japanese responses based on common patterns
+                match = _FALLBACK_TABLE.match(prompt)
+                if match:
+                    key, response = match
+                    logger.info(f"Using fallback response for '{key}': '{response}'")
+                else:
+                    response = "そうですね。他に何かお話ししませんか？"
             
             logger.info(f"Final response: '{response}'")
             return response
@@ -387,11 +998,9 @@ class ChatService:
             # タイムアウト付きでトークナイザー読み込み
             try:
                 tokenizer = await asyncio.wait_for(
-                    asyncio.to_thread(AutoTokenizer.from_pretrained, model_path),
+                    asyncio.to_thread(self._get_tokenizer, model_path),
                     timeout=30.0  # 30秒タイムアウト
                 )
-                if tokenizer.pad_token is None:
-                    tokenizer.pad_token = tokenizer.eos_token
                 logger.info("✅ Tokenizer loaded successfully")
             except asyncio.TimeoutError:
                 logger.error("❌ Tokenizer loading timeout - falling back to simple response")
@@ -401,6 +1010,7 @@ class ChatService:
             device = "cuda" if torch.cuda.is_available() else "cpu"
             dtype = torch.float16 if device == "cuda" else torch.float32
             logger.info(f"Using device: {device}, dtype: {dtype}")
+            quant_kwargs = self._quantization_kwargs(device)
             
             # タイムアウト付きでモデル読み込み
             try:
@@ -412,7 +1022,8 @@ class ChatService:
                         model_path,
                         torch_dtype=dtype,
                         device_map="auto" if device == "cuda" else None,
-                        trust_remote_code=True
+                        trust_remote_code=True,
+                        **quant_kwargs
                     ),
                     timeout=60.0  # 60秒タイムアウト
                 )
@@ -429,7 +1040,8 @@ class ChatService:
                             model_path,
                             torch_dtype=dtype,
                             device_map="auto" if device == "cuda" else None,
-                            trust_remote_code=True
+                            trust_remote_code=True,
+                            **quant_kwargs
                         ),
                         timeout=60.0
                     )
@@ -440,10 +1052,17 @@ class ChatService:
             
             if device == "cpu":
                 model = model.to(device)
+                if LLMLORA_QUANT != "off":
+                    model = self._quantize_dynamic(model)
+            
+            if LLMLORA_COMPILE:
+                self._compile_forward(model, device)
+            
+            await asyncio.get_running_loop().run_in_executor(self._gen_pool, self._warmup, model, tokenizer, device)
             
             # Cache the model and tokenizer
-            self.model_cache[job_id] = model
-            self.tokenizer_cache[job_id] = tokenizer
+            self.model_cache.put(job_id, model)
+            self.tokenizer_cache.put(job_id, tokenizer)
             
             logger.info(f"Model loaded successfully for job {job_id}")
             
@@ -451,6 +1070,82 @@ class ChatService:
             logger.error(f"Error loading model: {e}")
             raise
     
+    @staticmethod
+    def _quantize_dynamic(model):
+        """No bitsandbytes on CPU: dynamic int8 quantization of the Linear layers instead"""
+        # GPT-2 family blocks are Conv1D, which quantize_dynamic does not touch
+        if any(type(module).__name__ == "Conv1D" for module in model.modules()):
+            logger.info(f"{type(model).__name__} uses Conv1D layers, skipping dynamic int8 quantization")
+            return model
+        # Quantizing a PeftModel would also swap the LoRA lora_A/lora_B layers (their forward reads
+        # lora_A.weight.dtype), so fold the adapter into the base weights first
+        if hasattr(model, "merge_and_unload"):
+            model = model.merge_and_unload()
+        logger.info("Applying dynamic int8 quantization for CPU inference")
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    
+    @staticmethod
+    def _warmup(model, tokenizer, device: str):
+        """Run a tiny generate() so kernel JIT, autotuning and allocator growth happen before the first request"""
+        try:
+            dummy = _to_device(dict(tokenizer("ウォームアップ", return_tensors="pt")), device)
+            pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+            # With torch.compile the first call compiles and the second captures CUDA graphs
+            for _ in range(2 if LLMLORA_COMPILE else 1):
+                with torch.inference_mode():
+                    model.generate(**dummy, max_new_tokens=2, do_sample=False, pad_token_id=pad_token_id)
+            logger.info(f"🔥 Model warmed up ({device})")
+        except Exception as e:
+            logger.warning(f"Model warmup failed, first request will be slower: {e}")
+    
+    def _compile_forward(self, model, device: str, static_shapes: bool = False):
+        """Replace the transformers model's forward with a torch.compile'd version, keeping eager mode if compilation fails"""
+        try:
+            import torch._dynamo
+            # Graph breaks / unsupported ops fall back to eager instead of failing the request
+            torch._dynamo.config.suppress_errors = True
+            # PeftModel.generate() delegates to the wrapped transformers model's generate(), which calls
+            # that model's forward; PeftModel.forward is never on the decode path, so compile the inner one
+            target = model.get_base_model() if hasattr(model, "get_base_model") else model
+            target.forward = torch.compile(
+                target.forward,
+                mode="reduce-overhead" if device == "cuda" else "default",
+                fullgraph=static_shapes,
+                dynamic=not static_shapes
+            )
+            logger.info(f"⚡ torch.compile enabled for model forward ({device})")
+        except Exception as e:
+            logger.warning(f"torch.compile unavailable, using eager model: {e}")
+    
+    def _enable_static_cache(self, model, device: str):
+        """Use a pre-allocated StaticCache in generate() and compile forward for its fixed shapes"""
+        if not getattr(model, "_supports_static_cache", False):
+            logger.info(f"{type(model).__name__} has no StaticCache support, compiling with dynamic shapes")
+            self._compile_forward(model, device)
+            return
+        
+        # generate() allocates the StaticCache once and reset()s it on later calls with the same batch
+        # size, so KV tensors (and the attention mask) keep one shape and CUDA graphs are not re-captured
+        model.generation_config.cache_implementation = "static"
+        self._compile_forward(model, device, static_shapes=True)
+    
+    def _quantization_kwargs(self, device: str) -> Dict[str, Any]:
+        """Build bitsandbytes from_pretrained kwargs for the LLMLORA_QUANT setting"""
+        if device != "cuda" or LLMLORA_QUANT not in ("int8", "nf4"):
+            return {}
+        
+        from transformers import BitsAndBytesConfig
+        if LLMLORA_QUANT == "int8":
+            quantization_config = BitsAndBytesConfig(load_in_8bit=True)
+        else:
+            quantization_config = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+            )
+        logger.info(f"Using {LLMLORA_QUANT} weight quantization")
+        return {"quantization_config": quantization_config}
+    
     async def _generate_with_custom_model(
         self,
         model_name: str,
@@ -494,28 +1189,9 @@ class ChatService:
         # 処理時間シミュレーション
         start_time = time.time()
         
-        # 基本的な日本語応答パターン
-        responses = {
-            "こんにちは": "こんにちは！今日はいかがお過ごしですか？",
-            "こんばんは": "こんばんは！お疲れ様でした。今夜もよろしくお願いします。",
-            "おはよう": "おはようございます！今日も一日頑張りましょう。",
-            "ありがとう": "どういたしまして。お役に立てて嬉しいです。",
-            "元気": "はい、元気です！ありがとうございます。あなたはいかがですか？",
-            "天気": "今日は良い天気ですね。外出日和だと思います。",
-            "さようなら": "さようなら。また会いましょう！",
-            "はじめまして": "はじめまして！よろしくお願いします。",
-            "お疲れ": "お疲れ様でした！ゆっくり休んでくださいね。",
-            "こんにちわ": "こんにちは！お元気ですか？",
-            "テスト": "テスト応答です。rinna-3.6bモデルシミュレーションが動作しています。",
-            "Neural Engine": "Neural Engineシミュレーションモードで動作中です。",
-        }
-        
         # マッチング検索
-        response = None
-        for key, value in responses.items():
-            if key in prompt:
-                response = value
-                break
+        match = _SIMPLE_JAPANESE_TABLE.match(prompt)
+        response = match[1] if match else None
         
         # デフォルト応答
         if not response:
@@ -541,116 +1217,46 @@ class ChatService:
         max_tokens: int = 512
     ) -> str:
         """Generate response using rinna/japanese-gpt-neox-3.6b-instruction-sft with proper format"""
+        if not HF_AVAILABLE:
+            raise ValueError("PyTorch/Transformers not available - cannot load rinna model")
+        
         try:
-            import torch
-            from transformers import AutoTokenizer, AutoModelForCausalLM
-            import os
-            import asyncio
-            
-            logger.info(f"Loading rinna model: {model_name}")
-            
-            # タイムアウト付きでtokenizer読み込み
-            try:
-                tokenizer = await asyncio.wait_for(
-                    asyncio.to_thread(
-                        AutoTokenizer.from_pretrained,
-                        model_name, 
-                        trust_remote_code=True,
-                        use_fast=False
-                    ),
-                    timeout=30.0
-                )
-                logger.info("✅ Rinna tokenizer loaded")
-            except asyncio.TimeoutError:
-                logger.error("❌ Rinna tokenizer loading timeout")
-                return "モデル読み込みがタイムアウトしました。シンプル応答: こんばんは！お疲れ様でした。"
-            
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            dtype = torch.float16 if device == "cuda" else torch.float32
-            
-            # タイムアウト付きでモデル読み込み
             try:
-                model = await asyncio.wait_for(
-                    asyncio.to_thread(
-                        AutoModelForCausalLM.from_pretrained,
-                        model_name,
-                        torch_dtype=dtype,
-                        device_map="auto" if device == "cuda" else None,
-                        trust_remote_code=True
-                    ),
-                    timeout=60.0
+                response = await self._generate_core(
+                    f"rinna:{model_name}",
+                    # rinna's fast tokenizer loads fine but tokenizes differently; the model card requires the slow one
+                    lambda: self._get_or_load_hf(model_name, use_fast=False),
+                    RINNA_TEMPLATE,
+                    prompt,
+                    temperature=temperature,
+                    max_new_tokens=min(max_tokens, 100),
+                    repetition_penalty=1.1,
+                    top_p=0.9,
+                    top_k=40
                 )
-                logger.info("✅ Rinna model loaded successfully")
-            except asyncio.TimeoutError:
+            except TimeoutError:
                 logger.error("❌ Rinna model loading timeout")
                 return f"モデル読み込みタイムアウト。フォールバック応答: {await self._generate_simple_japanese_response(prompt)}"
             
-            if device == "cpu":
-                model = model.to(device)
-            
-            # Format prompt according to rinna's expected format
-            # The model expects: "ユーザー: <prompt><NL>システム: "
-            formatted_prompt = f"ユーザー: {prompt}<NL>システム: "
-            
-            logger.info(f"Formatted prompt for rinna: '{formatted_prompt}'")
-            
-            inputs = tokenizer(formatted_prompt, return_tensors="pt", truncation=True, max_length=512)
-            inputs = {k: v.to(device) for k, v in inputs.items()}
+            # Clean up response - remove any unwanted markers
+            response = response.replace("<NL>", "\n").strip()
             
-            with torch.no_grad():
-                outputs = model.generate(
-                    input_ids=inputs["input_ids"],
-                    attention_mask=inputs["attention_mask"],
-                    max_new_tokens=min(max_tokens, 100),
-                    temperature=temperature,
-                    do_sample=True,
-                    top_p=0.9,
-                    top_k=40,
-                    pad_token_id=tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id,
-                    eos_token_id=tokenizer.eos_token_id,
-                    early_stopping=True,
-                    repetition_penalty=1.1
+            # Basic validation
+            if not response or len(response) < 2:
+                # Fallback responses for common Japanese greetings
+                response = _fallback_response(
+                    _RINNA_FALLBACK_TABLE, prompt, "ご質問をありがとうございます。詳しく教えていただけますか？"
                 )
             
-            # Extract response
-            input_length = len(inputs["input_ids"][0])
-            if len(outputs[0]) > input_length:
-                response_tokens = outputs[0][input_length:]
-                response = tokenizer.decode(response_tokens, skip_special_tokens=True)
-                response = response.strip()
-                
-                # Clean up response - remove any unwanted markers
-                response = response.replace("<NL>", "\n")
-                
-                # Remove any continuation of the conversation format
-                if "ユーザー:" in response:
-                    response = response.split("ユーザー:")[0].strip()
-                
-                # Basic validation
-                if not response or len(response) < 2:
-                    # Fallback responses for common Japanese greetings
-                    if "こんにちは" in prompt:
-                        response = "こんにちは！今日はどのようなことについてお話ししましょうか？"
-                    elif "おはよう" in prompt:
-                        response = "おはようございます！今日も一日よろしくお願いします。"
-                    elif "元気" in prompt:
-                        response = "はい、元気です！ありがとうございます。あなたはいかがですか？"
-                    elif "ありがとう" in prompt:
-                        response = "どういたしまして。他にもお手伝いできることがあれば教えてください。"
-                    else:
-                        response = "ご質問をありがとうございます。詳しく教えていただけますか？"
-                
-                logger.info(f"Rinna model response: '{response}'")
-                return response
-            else:
-                return "申し訳ございません、適切な応答を生成できませんでした。"
-                
+            logger.info(f"Rinna model response: '{response}'")
+            return response
+        
         except Exception as e:
             logger.error(f"Error generating with rinna model {model_name}: {e}")
             import traceback
             logger.error(f"Traceback: {traceback.format_exc()}")
             return f"rinnaモデルでの生成中にエラーが発生しました: {str(e)}"
-
+    
     async def _generate_with_hf_model(
         self,
         model_name: str,
@@ -658,84 +1264,44 @@ class ChatService:
         temperature: float = 0.7,
         max_tokens: int = 512
     ) -> str:
-        """Generate response using HuggingFace model directly"""
+        """Generate response using HuggingFace model directly (or a vLLM/TGI server when VLLM_URL is set)"""
+        from services.vllm_service import vllm_service
+        if not HF_AVAILABLE and not vllm_service.enabled:
+            raise ValueError("PyTorch/Transformers not available - cannot load HuggingFace model")
+        
         try:
-            import torch
-            from transformers import AutoTokenizer, AutoModelForCausalLM
-            import os
-            
-            logger.info(f"Loading HuggingFace model: {model_name}")
-            
-            # Use HF token if available
-            hf_token = os.environ.get('HF_TOKEN')
-            
-            # Load tokenizer and model
-            tokenizer = AutoTokenizer.from_pretrained(
-                model_name, 
-                token=hf_token,
-                trust_remote_code=True
-            )
-            if tokenizer.pad_token is None:
-                tokenizer.pad_token = tokenizer.eos_token
-            
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            dtype = torch.float16 if device == "cuda" else torch.float32
-            
-            model = AutoModelForCausalLM.from_pretrained(
-                model_name,
-                token=hf_token,
-                torch_dtype=dtype,
-                device_map="auto" if device == "cuda" else None,
-                trust_remote_code=True
-            )
-            
-            if device == "cpu":
-                model = model.to(device)
-            
-            # Japanese GPT simple format
-            formatted_prompt = prompt
-            inputs = tokenizer(formatted_prompt, return_tensors="pt", truncation=True, max_length=200)
-            inputs = {k: v.to(device) for k, v in inputs.items()}
-            
-            with torch.no_grad():
-                outputs = model.generate(
-                    input_ids=inputs["input_ids"],
-                    attention_mask=inputs["attention_mask"],
-                    max_new_tokens=30,
+            # Delegate to a vLLM/TGI server (PagedAttention + continuous batching) when configured
+            if vllm_service.enabled:
+                response = (await vllm_service.generate(
+                    model_name,
+                    prompt,
+                    temperature=temperature,
+                    max_tokens=min(max_tokens, 150)
+                )).strip()
+            else:
+                # Use HF token if available
+                hf_token = os.environ.get('HF_TOKEN')
+                
+                # Japanese GPT simple format
+                response = await self._generate_core(
+                    f"hf:{model_name}",
+                    lambda: self._get_or_load_hf(model_name, hf_token),
+                    HF_TEMPLATE,
+                    prompt,
                     temperature=0.8,
-                    do_sample=True,
+                    max_new_tokens=30,
+                    repetition_penalty=1.2,
                     top_p=0.9,
-                    pad_token_id=tokenizer.pad_token_id,
-                    eos_token_id=tokenizer.eos_token_id,
-                    early_stopping=True,
-                    repetition_penalty=1.2
+                    max_length=200
                 )
             
-            # Extract response
-            input_length = len(inputs["input_ids"][0])
-            if len(outputs[0]) > input_length:
-                response_tokens = outputs[0][input_length:]
-                response = tokenizer.decode(response_tokens, skip_special_tokens=True)
-                response = response.strip()
-                
-                # Basic cleanup
-                if not response or len(response) < 2:
-                    # Fallback responses based on input
-                    if "こんにちは" in prompt:
-                        response = "こんにちは！元気ですか？"
-                    elif "元気" in prompt:
-                        response = "はい、元気です！ありがとうございます。"
-                    elif "ありがとう" in prompt:
-                        response = "どういたしまして。"
-                    elif "天気" in prompt:
-                        response = "今日は良い天気ですね。"
-                    else:
-                        response = "そうですね。"
-                
-                return response
-            else:
-                return "申し訳ございません、応答できませんでした。"
-                
+            # Basic cleanup
+            if not response or len(response) < 2:
+                # Fallback responses based on input
+                response = _fallback_response(_MODEL_FALLBACK_TABLE, prompt, "そうですね。")
+            
+            return response
+        
         except Exception as e:
             logger.error(f"Error generating with HF model {model_name}: {e}")
             return f"モデル {model_name} での生成中にエラーが発生しました。"
@@ -751,53 +1317,61 @@ class ChatService:
         try:
             logger.info(f"Generating with Ollama model: {model_name} for prompt: '{prompt[:50]}...'")
             
-            from services.ollama_service import OllamaService
-            
-            async with OllamaService() as ollama:
-                response = await ollama.generate(
-                    model_name=model_name,
-                    prompt=prompt,
-                    options={
-                        "temperature": temperature,
-                        "num_predict": max_tokens,
-                        "stop": ["User:", "Human:", "\n\nUser:", "\n\nHuman:"]
-                    }
-                )
-                
-                generated_text = response.get("response", "").strip()
-                logger.info(f"Ollama response: '{generated_text}'")
-                
-                if not generated_text:
-                    return "申し訳ございませんが、応答を生成できませんでした。"
-                
-                return generated_text
-                
+            generated_text = "".join([
+                chunk async for chunk in self._stream_with_ollama(model_name, prompt, temperature, max_tokens)
+            ]).strip()
+            logger.info(f"Ollama response: '{generated_text}'")
+            
+            if not generated_text:
+                return "申し訳ございませんが、応答を生成できませんでした。"
+            
+            return generated_text
+            
         except Exception as e:
             logger.error(f"Error generating with Ollama: {e}")
             return "Ollamaでの生成中にエラーが発生しました。"
     
+    async def _stream_with_ollama(
+        self,
+        model_name: str,
+        prompt: str,
+        temperature: float = 0.7,
+        max_tokens: int = 512
+    ) -> AsyncIterator[str]:
+        """Stream response text from an Ollama model as it is generated"""
+        from services.ollama_service import ollama_service
+        
+        async for chunk in ollama_service.generate_stream(
+            model_name=model_name,
+            prompt=prompt,
+            options={
+                "temperature": temperature,
+                "num_predict": max_tokens,
+                "stop": ["User:", "Human:", "\n\nUser:", "\n\nHuman:"]
+            }
+        ):
+            yield chunk
+    
     async def delete_session(self, session_id: int):
         """Delete a chat session and its messages"""
         async with AsyncSessionLocal() as db:
             try:
-                # Check if session exists
-                result = await db.execute(select(ChatSession).where(ChatSession.id == session_id))
-                session = result.scalar_one_or_none()
-                
-                if not session:
+                # One round-trip: the CTE removes the messages, the outer DELETE the session.
+                # RETURNING tells us whether the session existed.
+                result = await db.execute(
+                    text(
+                        "WITH deleted_messages AS (DELETE FROM chat_messages WHERE session_id = :session_id) "
+                        "DELETE FROM chat_sessions WHERE id = :session_id RETURNING id"
+                    ),
+                    {"session_id": session_id}
+                )
+                if result.first() is None:
                     raise ValueError(f"Chat session {session_id} not found")
                 
-                # Use raw SQL to delete messages first
-                await db.execute(text("DELETE FROM chat_messages WHERE session_id = :session_id"), 
-                                {"session_id": session_id})
-                
-                # Then delete the session using raw SQL
-                await db.execute(text("DELETE FROM chat_sessions WHERE id = :session_id"), 
-                                {"session_id": session_id})
-                
                 # Commit all changes
                 await db.commit()
-                logger.info(f"Successfully deleted chat session {session_id} using raw SQL")
+                self.invalidate_session(session_id)
+                logger.info(f"Successfully deleted chat session {session_id}")
                 
             except ValueError:
                 await db.rollback()
@@ -817,8 +1391,25 @@ class ChatService:
         try:
             logger.info(f"Loading Neural Engine model from: {model_path}")
             
-            # Load Core ML model
-            coreml_model = ct.models.MLModel(model_path)
+            # Prefer a weight-quantized variant, creating it once if requested
+            if NE_QUANTIZE in NE_QUANTIZED_DTYPES:
+                quantized_path = _ne_quantized_path(model_path, NE_QUANTIZE)
+                if not os.path.exists(quantized_path):
+                    try:
+                        logger.info(f"Quantizing Neural Engine model weights to {NE_QUANTIZE}: {quantized_path}")
+                        await asyncio.to_thread(_quantize_ne_model, model_path, NE_QUANTIZE, quantized_path)
+                    except Exception as e:
+                        logger.warning(f"{NE_QUANTIZE} quantization failed, using FP16 model: {e}")
+            load_path = _ne_load_path(model_path)
+            
+            # Diagnose silent CPU fallback by timing each compute unit once
+            if NE_BENCHMARK:
+                await asyncio.to_thread(self._benchmark_compute_units, load_path)
+            
+            # Load Core ML model pinned to the configured compute units
+            coreml_model = ct.models.MLModel(load_path, compute_units=_ne_compute_units())
+            logger.info(f"Neural Engine model file: {os.path.basename(load_path)}")
+            logger.info(f"Neural Engine model compute units: {NE_COMPUTE_UNIT}")
             
             # Find and load corresponding tokenizer
             tokenizer_path = model_path.replace('.mlpackage', '_tokenizer')
@@ -830,14 +1421,11 @@ class ChatService:
                 else:
                     raise ValueError(f"Cannot find tokenizer for Neural Engine model {model_path}")
             
-            from transformers import AutoTokenizer
-            tokenizer = AutoTokenizer.from_pretrained(tokenizer_path)
-            if tokenizer.pad_token is None:
-                tokenizer.pad_token = tokenizer.eos_token
+            tokenizer = self._get_tokenizer(tokenizer_path)
             
             # Cache models
-            self.neural_engine_cache[job_id] = coreml_model
-            self.neural_engine_tokenizer_cache[job_id] = tokenizer
+            self.neural_engine_cache.put(job_id, coreml_model)
+            self.neural_engine_tokenizer_cache.put(job_id, tokenizer)
             
             logger.info(f"✅ Neural Engine model loaded successfully for job {job_id}")
             
@@ -845,6 +1433,106 @@ class ChatService:
             logger.error(f"Error loading Neural Engine model: {e}")
             raise
 
+    @staticmethod
+    def _benchmark_compute_units(model_path: str, runs: int = 3) -> Dict[str, float]:
+        """Time predict() on a dummy input with each compute unit and log the fastest"""
+        dummy_input = {
+            "input_ids": np.zeros((1, NE_WINDOW), dtype=np.int32),
+            "attention_mask": np.ones((1, NE_WINDOW), dtype=np.int32)
+        }
+        timings: Dict[str, float] = {}
+        for name in ("ALL", "CPU_AND_NE", "CPU_AND_GPU", "CPU_ONLY"):
+            try:
+                model = ct.models.MLModel(model_path, compute_units=getattr(ct.ComputeUnit, name))
+                model.predict(dummy_input)  # First call includes device compilation
+                start_time = time.perf_counter()
+                for _ in range(runs):
+                    model.predict(dummy_input)
+                timings[name] = (time.perf_counter() - start_time) / runs * 1000
+                logger.info(f"Neural Engine benchmark {name}: {timings[name]:.2f}ms/predict")
+            except Exception as e:
+                logger.warning(f"Neural Engine benchmark {name} failed: {e}")
+        
+        if timings:
+            fastest = min(timings, key=timings.get)
+            logger.info(f"⚡ Fastest compute unit: {fastest} (configured: {NE_COMPUTE_UNIT})")
+            if timings.get("CPU_AND_NE", 0) >= timings.get("CPU_ONLY", float("inf")) * 0.9:
+                logger.warning("CPU_AND_NE is no faster than CPU_ONLY - model is likely falling back to CPU")
+        return timings
+    
+    @staticmethod
+    def _ne_input_window(model) -> Optional[int]:
+        """Fixed sequence length of the model's input_ids, or None if the export accepts a range of lengths"""
+        for feature in model.get_spec().description.input:
+            if feature.name != "input_ids":
+                continue
+            array_type = feature.type.multiArrayType
+            if array_type.WhichOneof("ShapeFlexibility") == "shapeRange":
+                return None
+            if len(array_type.shape) > 0:
+                return int(array_type.shape[-1])
+        return NE_WINDOW
+    
+    @staticmethod
+    def _ne_greedy_decode(model, tokenizer, prompt_ids: List[int], max_new_tokens: int) -> List[int]:
+        """Greedy autoregressive decoding on a Core ML model, reading only the last position's logits"""
+        eos_token_id = tokenizer.eos_token_id
+        generated: List[int] = []
+        
+        if len(model.get_spec().description.state) > 0:
+            # Stateful export (iOS 18 MLState): the KV cache lives in the state, so after the
+            # prompt only the newest token is fed each step
+            state = model.make_state()
+            feed, total = prompt_ids, 0
+            for _ in range(max_new_tokens):
+                total += len(feed)
+                result = model.predict({
+                    "input_ids": np.array([feed], dtype=np.int32),
+                    "attention_mask": np.ones((1, total), dtype=np.int32)
+                }, state=state)
+                next_id = int(np.argmax(result["logits"][0, -1]))
+                if next_id == eos_token_id:
+                    break
+                generated.append(next_id)
+                feed = [next_id]
+            return generated
+        
+        window = ChatService._ne_input_window(model)
+        if window is None:
+            # Flexible-length export (RangeDim): feed only the real tokens, no padding
+            ids = list(prompt_ids)
+            for _ in range(max_new_tokens):
+                result = model.predict({
+                    "input_ids": np.array([ids], dtype=np.int32),
+                    "attention_mask": np.ones((1, len(ids)), dtype=np.int32)
+                })
+                next_id = int(np.argmax(result["logits"][0, -1]))
+                if next_id == eos_token_id:
+                    break
+                generated.append(next_id)
+                ids.append(next_id)
+            return generated
+        
+        # Fixed-shape export: right-pad to the model's window and read the logits at the last real
+        # position (causal attention keeps the padding from affecting earlier positions)
+        pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else eos_token_id
+        input_ids = np.full((1, window), pad_token_id, dtype=np.int32)
+        attention_mask = np.zeros((1, window), dtype=np.int32)
+        prompt_ids = prompt_ids[-(window - 1):]
+        length = len(prompt_ids)
+        input_ids[0, :length] = prompt_ids
+        attention_mask[0, :length] = 1
+        for _ in range(min(max_new_tokens, window - length)):
+            result = model.predict({"input_ids": input_ids, "attention_mask": attention_mask})
+            next_id = int(np.argmax(result["logits"][0, length - 1]))
+            if next_id == eos_token_id:
+                break
+            generated.append(next_id)
+            input_ids[0, length] = next_id
+            attention_mask[0, length] = 1
+            length += 1
+        return generated
+    
     async def _generate_with_neural_engine(
         self,
         job_id: int,
@@ -865,52 +1553,29 @@ class ChatService:
             # Format prompt for Japanese chat
             formatted_prompt = f"User: {prompt} Bot:"
             
-            # Tokenize input
-            inputs = tokenizer(
-                formatted_prompt,
-                return_tensors="pt",
-                max_length=min(max_tokens, 64),
-                padding="max_length",
-                truncation=True
+            # Tokenize input at its real length; the decode loop handles any fixed-shape padding
+            prompt_ids = await asyncio.to_thread(
+                tokenizer.encode, formatted_prompt, truncation=True, max_length=NE_WINDOW - 1
             )
+            logger.debug("Neural Engine prompt length: {}", len(prompt_ids))
             
-            logger.info(f"Neural Engine input shape: {inputs['input_ids'].shape}")
-            
-            # Prepare input for Core ML
-            input_dict = {
-                "input_ids": inputs['input_ids'].numpy().astype('int32'),
-                "attention_mask": inputs['attention_mask'].numpy().astype('int32')
-            }
-            
-            # Neural Engine inference
-            import time
+            # Neural Engine inference (greedy autoregressive decode)
             start_time = time.time()
-            result = model.predict(input_dict)
+            response_tokens = await asyncio.get_running_loop().run_in_executor(
+                self._gen_pool,
+                self._ne_greedy_decode,
+                model,
+                tokenizer,
+                prompt_ids,
+                min(max_tokens, NE_MAX_NEW_TOKENS)
+            )
             inference_time = time.time() - start_time
             
-            logger.info(f"Neural Engine inference time: {inference_time*1000:.2f}ms")
-            
-            # Get logits and find best tokens
-            logits = result['logits']
-            
-            # Simple greedy decoding for now
-            predicted_ids = np.argmax(logits, axis=-1)
-            
-            # Decode tokens
-            if len(predicted_ids.shape) > 1:
-                predicted_ids = predicted_ids[0]  # Remove batch dimension
-            
-            # Find new tokens (after input)
-            input_length = len(inputs['input_ids'][0])
-            if len(predicted_ids) > input_length:
-                # For this simple demo, just take the next few tokens
-                response_tokens = predicted_ids[:10]  # Take first 10 tokens as response
-            else:
-                response_tokens = predicted_ids[:5]   # Fallback
+            logger.info(f"Neural Engine inference time: {inference_time*1000:.2f}ms ({len(response_tokens)} tokens)")
             
             # Decode response
             try:
-                response = tokenizer.decode(response_tokens, skip_special_tokens=True)
+                response = await asyncio.to_thread(tokenizer.decode, response_tokens, skip_special_tokens=True)
                 response = response.strip()
                 
                 # Clean up response
@@ -922,14 +1587,9 @@ class ChatService:
                 # Basic validation and fallback
                 if not response or len(response) < 2:
                     # Provide contextual Japanese responses
-                    if "こんにちは" in prompt:
-                        response = "こんにちは！Neural Engineで処理しています。"
-                    elif "天気" in prompt:
-                        response = "今日は良い天気ですね。"
-                    elif "ありがとう" in prompt:
-                        response = "どういたしまして。"
-                    else:
-                        response = f"Neural Engineで高速処理しました（{inference_time*1000:.1f}ms）"
+                    response = _fallback_response(
+                        _MODEL_FALLBACK_TABLE, prompt, f"Neural Engineで高速処理しました（{inference_time*1000:.1f}ms）"
+                    )
                 
                 logger.info(f"Neural Engine response: '{response}' (inference: {inference_time*1000:.2f}ms)")
                 return response
@@ -942,27 +1602,52 @@ class ChatService:
             logger.error(f"Error generating with Neural Engine: {e}")
             return "Neural Engineでの生成中にエラーが発生しました。"
 
+    @staticmethod
+    def _ne_manifest_ok(package_path: str) -> bool:
+        """True if the .mlpackage manifest parses and lists its model files"""
+        try:
+            with open(os.path.join(package_path, "Manifest.json"), "rb") as f:
+                manifest = json.load(f)
+            return bool(manifest.get("itemInfoEntries"))
+        except (OSError, ValueError, AttributeError):
+            return False
+
     def is_neural_engine_available(self, job_id: int) -> bool:
         """Check if Neural Engine model is available for a job"""
         if not COREML_AVAILABLE:
             return False
         
-        # Check for Neural Engine model file
-        ne_model_path = f"/app/training_data/job_{job_id}/neural_engine_model.mlpackage"
-        model_exists = os.path.exists(ne_model_path)
-        
-        if not model_exists:
-            return False
+        # Already loaded and cached
+        if job_id in self.neural_engine_cache:
+            return True
         
-        # Test if Core ML can actually load the model (Docker compatibility check)
+        # Check for Neural Engine model file (single stat call)
+        ne_model_path = f"/app/training_data/job_{job_id}/neural_engine_model.mlpackage"
         try:
-            import coremltools as ct
-            # Quick load test
-            test_model = ct.models.MLModel(ne_model_path)
-            return True
-        except Exception as e:
-            logger.warning(f"Neural Engine model exists but cannot be loaded: {e}")
+            mtime = os.stat(ne_model_path).st_mtime
+        except OSError:
             return False
+        
+        # Reuse the previous load test while the model file is unchanged
+        cached = self._ne_available_cache.get(job_id)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        
+        # Cheap probe first: a well-formed package on macOS (the Core ML runtime is macOS-only) is loadable
+        # without instantiating the model; otherwise fall back to a full load test (Docker compatibility check)
+        load_path = _ne_load_path(ne_model_path)
+        if sys.platform == "darwin" and self._ne_manifest_ok(load_path):
+            available = True
+        else:
+            try:
+                ct.models.MLModel(load_path, compute_units=_ne_compute_units())
+                available = True
+            except Exception as e:
+                logger.warning(f"Neural Engine model exists but cannot be loaded: {e}")
+                available = False
+        
+        self._ne_available_cache[job_id] = (mtime, available)
+        return available
 
     async def get_neural_engine_status(self) -> Dict[str, Any]:
         """Get Neural Engine availability status"""
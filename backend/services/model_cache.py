@@ -0,0 +1,32 @@
+import gc
+from collections import OrderedDict
+from loguru import logger
+
+try:
+    import torch
+    TORCH_AVAILABLE = True
+except ImportError:
+    TORCH_AVAILABLE = False
+
+# Maximum number of models kept resident per cache
+MAX_CACHED_MODELS = 3
+
+class LRUModelCache(OrderedDict):
+    """Bounded LRU cache that releases model memory on eviction"""
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def put(self, key, value, max_items: int = MAX_CACHED_MODELS):
+        """Insert a value and evict the least recently used entries beyond max_items"""
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > max_items:
+            oldest_key, oldest_value = self.popitem(last=False)
+            logger.info(f"Evicting cached model: {oldest_key}")
+            del oldest_value
+            gc.collect()
+            if TORCH_AVAILABLE and torch.cuda.is_available():
+                torch.cuda.empty_cache()
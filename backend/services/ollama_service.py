@@ -1,26 +1,76 @@
 import httpx
 import os
-from typing import List, Dict, Any
+import json
+import time
+from typing import Dict, Any, AsyncIterator, FrozenSet, Optional, Tuple
 from models.schemas import OllamaModel, ModelListResponse
 from datetime import datetime
 from loguru import logger
 
-class OllamaService:
-    def __init__(self):
-        self.base_url = os.getenv("OLLAMA_URL", "http://ollama:11434")
-        self.client = httpx.AsyncClient(timeout=60.0)
+# orjson parses/serializes several times faster than the stdlib json module
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+def json_loads(data):
+    return orjson.loads(data) if ORJSON_AVAILABLE else json.loads(data)
+
+def json_body(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """httpx request kwargs for a JSON payload, pre-encoded with orjson when available"""
+    if ORJSON_AVAILABLE:
+        return {"content": orjson.dumps(payload), "headers": {"Content-Type": "application/json"}}
+    return {"json": payload}
+
+# HTTP/2 support needs the h2 package (httpx[http2])
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
-    async def __aenter__(self):
-        return self
+# Environment-specific defaults (e.g. OLLAMA_URL=http://localhost:11434 outside Docker)
+DEFAULT_BASE_URL = os.getenv("OLLAMA_URL", "http://ollama:11434")
+DEFAULT_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "60"))
 
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
+# /api/tags results are reused for this many seconds (model existence is checked on every chat request)
+MODEL_LIST_TTL = 5.0
+
+class OllamaService:
+    def __init__(self, base_url: str = DEFAULT_BASE_URL, timeout: float = DEFAULT_TIMEOUT):
+        self.base_url = base_url
+        # One pooled client for the whole process: connections are reused across chat turns.
+        # HTTP/2 is negotiated over TLS (e.g. a proxied Ollama); plain http:// stays on HTTP/1.1 keep-alive.
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(connect=5.0, read=timeout, write=timeout, pool=5.0),
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=60.0)
+        )
+        self._models_cache: Optional[Tuple[float, ModelListResponse, FrozenSet[str]]] = None
+
+    async def aclose(self):
         await self.client.aclose()
 
     async def list_models(self) -> ModelListResponse:
+        return (await self._cached_models())[0]
+
+    async def _cached_models(self) -> Tuple[ModelListResponse, FrozenSet[str]]:
+        """Model list plus a name set for O(1) existence checks, refreshed after MODEL_LIST_TTL"""
+        if self._models_cache and time.monotonic() - self._models_cache[0] < MODEL_LIST_TTL:
+            return self._models_cache[1], self._models_cache[2]
+        
+        model_list = await self._fetch_models()
+        names = frozenset(model.name for model in model_list.models)
+        self._models_cache = (time.monotonic(), model_list, names)
+        return model_list, names
+
+    async def _fetch_models(self) -> ModelListResponse:
         try:
-            response = await self.client.get(f"{self.base_url}/api/tags")
+            response = await self.client.get("/api/tags")
             response.raise_for_status()
-            data = response.json()
+            data = json_loads(response.content)
             
             models = []
             for model_info in data.get("models", []):
@@ -40,8 +90,8 @@ class OllamaService:
 
     async def check_model_exists(self, model_name: str) -> bool:
         try:
-            models = await self.list_models()
-            return any(model.name == model_name for model in models.models)
+            _, names = await self._cached_models()
+            return model_name in names
         except Exception as e:
             logger.error(f"Error checking model existence: {e}")
             return False
@@ -49,10 +99,11 @@ class OllamaService:
     async def pull_model(self, model_name: str) -> Dict[str, Any]:
         try:
             response = await self.client.post(
-                f"{self.base_url}/api/pull",
-                json={"name": model_name}
+                "/api/pull",
+                **json_body({"name": model_name})
             )
             response.raise_for_status()
+            self._models_cache = None  # The pulled model must show up on the next listing
             return {"status": "success", "message": f"Model {model_name} pulled successfully"}
         except httpx.HTTPError as e:
             logger.error(f"Error pulling model {model_name}: {e}")
@@ -71,14 +122,14 @@ class OllamaService:
             }
             
             response = await self.client.post(
-                f"{self.base_url}/api/generate",
-                json=request_payload
+                "/api/generate",
+                **json_body(request_payload)
             )
             
             logger.info(f"Ollama response status: {response.status_code}")
             
             response.raise_for_status()
-            result = response.json()
+            result = json_loads(response.content)
             
             logger.info(f"Ollama response received: {len(result.get('response', ''))} characters")
             
@@ -93,10 +144,37 @@ class OllamaService:
             logger.error(f"Traceback: {traceback.format_exc()}")
             raise Exception(f"Failed to generate: {e}")
 
+    async def generate_stream(self, model_name: str, prompt: str, **kwargs) -> AsyncIterator[str]:
+        """Yield response text pieces as Ollama produces them (newline-delimited JSON stream)"""
+        request_payload = {
+            "model": model_name,
+            "prompt": prompt,
+            "stream": True,
+            **kwargs
+        }
+        
+        try:
+            async with self.client.stream("POST", "/api/generate", **json_body(request_payload)) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    chunk = json_loads(line)
+                    if chunk.get("response"):
+                        yield chunk["response"]
+                    if chunk.get("done"):
+                        break
+        except httpx.HTTPError as e:
+            logger.error(f"HTTP Error streaming from model {model_name}: {e}")
+            raise Exception(f"Failed to generate: {e}")
+
     async def health_check(self) -> bool:
         try:
-            response = await self.client.get(f"{self.base_url}/api/tags")
+            response = await self.client.get("/api/tags")
             return response.status_code == 200
         except Exception as e:
             logger.error(f"Ollama health check failed: {e}")
-            return False
\ No newline at end of file
+            return False
+
+# Process-wide instance; the client is closed on application shutdown
+ollama_service = OllamaService()
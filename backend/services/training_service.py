@@ -1,22 +1,110 @@
 import asyncio
 import os
+import math
+import time
+import queue
+import threading
+import json
+import hashlib
+import shutil
+import importlib.util
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple, Union
 from pathlib import Path
 import torch
 from transformers import (
-    AutoTokenizer, AutoModelForCausalLM, TrainingArguments, Trainer,
+    AutoConfig, AutoTokenizer, AutoModelForCausalLM, TrainingArguments, Trainer,
     DataCollatorForLanguageModeling
 )
-from peft import LoraConfig, get_peft_model, TaskType
-from datasets import Dataset as HFDataset
+from peft import LoraConfig, PeftModel, get_peft_model, prepare_model_for_kbit_training, TaskType
+from datasets import Dataset as HFDataset, IterableDataset
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update
+from sqlalchemy import select, update, insert, text
 from loguru import logger
 
-from database.database import AsyncSessionLocal
+from database.database import AsyncSessionLocal, SessionLocal
 from models.database_models import TrainingJob, Dataset, TrainingMetrics as DBTrainingMetrics
 from models.schemas import TrainingStatus
+from services.model_cache import LRUModelCache
+
+# bitsandbytes enables paged 8-bit optimizers (and 4-bit loading) on CUDA
+try:
+    import bitsandbytes  # noqa: F401
+    BNB_AVAILABLE = True
+except ImportError:
+    BNB_AVAILABLE = False
+
+# FlashAttention-2 kernels (optional, CUDA-only build); checked without importing the CUDA extension
+FLASH_ATTN_AVAILABLE = importlib.util.find_spec("flash_attn") is not None
+
+# Dataset record schemas that map to a "User: ... Bot: ..." pair, checked in order
+PROMPT_RESPONSE_COLUMNS = (("instruction", "output"), ("input", "output"), ("question", "answer"))
+
+# LoRA target modules per model-name prefix, sorted longest first so e.g. "google/gemma-2" beats "google/gemma"
+LORA_TARGET_MODULES = sorted([
+    # GPT-2 based models (DialoGPT)
+    ("microsoft/DialoGPT", ["c_attn", "c_proj"]),
+    
+    # Japanese models (GPT-NeoX architecture)
+    ("rinna/japanese-gpt-neox", ["query_key_value", "dense"]),
+    ("rinna/japanese-gpt-1b", ["c_attn", "c_proj"]),  # GPT-2 architecture
+    ("cyberagent/open-calm", ["query_key_value", "dense"]),
+    
+    # LLaMA based models
+    ("meta-llama", ["q_proj", "v_proj", "k_proj", "o_proj"]),
+    ("mistralai", ["q_proj", "v_proj", "k_proj", "o_proj"]),
+    
+    # Gemma models (specific architecture)
+    ("google/gemma-2", ["q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj"]),
+    ("google/gemma", ["q_proj", "v_proj", "k_proj", "o_proj"]),
+], key=lambda entry: len(entry[0]), reverse=True)
+# Default fallback for GPT-2 based models (most common)
+DEFAULT_TARGET_MODULES = ["c_attn", "c_proj"]
+
+# Datasets at least this large are tokenized on the fly by dataloader workers instead of up front;
+# below it the cached Arrow path wins because streaming re-tokenizes every epoch
+STREAMING_MIN_SAMPLES = int(os.getenv("LLMLORA_STREAMING_MIN_SAMPLES", "50000"))
+# One shard per worker; half the cores leaves the rest for the training step itself
+STREAMING_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+# Opt-in effective (global) batch reached by raising gradient accumulation, 0 (default) keeps the job's
+# configured value; small datasets keep at least MIN_STEPS_PER_EPOCH optimizer steps per epoch
+TARGET_GLOBAL_BATCH = int(os.getenv("LLMLORA_TARGET_BATCH", "0"))
+MIN_STEPS_PER_EPOCH = 10
+
+# DataLoader worker processes for pre-tokenized datasets on GPU (CPU training stays single-process to save RAM)
+DATALOADER_WORKERS = min(4, os.cpu_count() or 1)
+
+# Bump when the tokenized dataset layout changes so stale Arrow caches are not reused
+DATASET_CACHE_VERSION = 4
+# Most recently used tokenized datasets kept on disk; older entries and other cache versions are pruned after each save
+MAX_CACHED_DATASETS = int(os.getenv("LLMLORA_DATASET_CACHE_ENTRIES", "8"))
+
+# 4-bit NF4 (QLoRA) base weights for GPU training: "auto" quantizes models above QLORA_MIN_PARAMS,
+# "nf4" quantizes every model, "off" never quantizes
+TRAIN_QUANT = os.getenv("LLMLORA_TRAIN_QUANT", "auto").lower()
+QLORA_MIN_PARAMS = 1_000_000_000
+
+# Base models stay resident between jobs (TrainingService is created per request, so the caches are module level).
+# LoRA layers, input-grad hooks and compiled forwards are removed after a successful job; a failed job evicts
+# its base model instead. A job whose base model is busy in another job loads a private copy.
+MAX_CACHED_BASE_MODELS = 2
+_base_model_cache = LRUModelCache()  # (model_name, dtype, device) -> frozen base model
+_base_models_in_use: set = set()
+_tokenizer_cache = LRUModelCache()  # model_name -> tokenizer
+_trainable_param_counts: Dict[tuple, Tuple[int, int]] = {}  # (model, dtype, r, modules) -> (trainable, total)
+
+# Training metric rows are bulk-inserted in groups of this size; job progress is updated at most once per interval
+METRICS_FLUSH_ROWS = 32
+METRICS_FLUSH_INTERVAL = 2.0  # seconds; buffered rows are also written once they are this old
+METRICS_QUEUE_SIZE = 10_000  # Records beyond this are dropped rather than blocking the training loop
+PROGRESS_WRITE_INTERVAL = 1.0  # seconds
+PROGRESS_MIN_DELTA = 0.5  # percent; smaller progress changes are not written...
+PROGRESS_MAX_INTERVAL = 30.0  # ...unless this many seconds passed since the last write (keeps loss/step fresh)
+
+# Opt-in torch.compile of the repeated decoder blocks on GPU (regional compilation keeps compile time low,
+# but it still adds minutes per job and is fragile with checkpointing and PEFT/bitsandbytes layers)
+TRAIN_COMPILE = os.getenv("LLMLORA_TRAIN_COMPILE", "off").lower() in ("1", "true", "on")
 
 class TrainingService:
     def __init__(self):
@@ -58,6 +146,9 @@ class TrainingService:
 
     async def _run_training(self, db: AsyncSession, job: TrainingJob, dataset: Dataset):
         """Execute the actual training process"""
+        model = None
+        cache_key = None
+        succeeded = False
         try:
             # Prepare output directory
             job_output_dir = Path(self.output_dir) / f"job_{job.id}"
@@ -77,20 +168,32 @@ class TrainingService:
             
             # Stage 2: Loading tokenizer
             await self._update_job_stage(db, job.id, "TOKENIZER", 20.0, "トークナイザーをロード中...", 240)
-            logger.info(f"Loading tokenizer for {model_name}...")
-            tokenizer = AutoTokenizer.from_pretrained(
-                model_name,
-                cache_dir=self.model_cache_dir,
-                trust_remote_code=True
-            )
-            logger.info("Tokenizer loaded successfully")
+            if model_name in _tokenizer_cache:
+                tokenizer = _tokenizer_cache[model_name]
+            else:
+                logger.info(f"Loading tokenizer for {model_name}...")
+                tokenizer = await asyncio.to_thread(
+                    AutoTokenizer.from_pretrained,
+                    model_name,
+                    cache_dir=self.model_cache_dir,
+                    trust_remote_code=True
+                )
+                _tokenizer_cache.put(model_name, tokenizer)
+                logger.info("Tokenizer loaded successfully")
             
             if tokenizer.pad_token is None:
                 tokenizer.pad_token = tokenizer.eos_token
 
             # Determine appropriate dtype based on device availability
+            # Mixed precision: BF16 on Ampere+ GPUs, FP16 on older GPUs, FP32 on CPU
             device = "cuda" if torch.cuda.is_available() else "cpu"
-            dtype = torch.float16 if device == "cuda" else torch.float32
+            bf16 = device == "cuda" and torch.cuda.is_bf16_supported()
+            fp16 = device == "cuda" and not bf16
+            dtype = torch.bfloat16 if bf16 else (torch.float16 if fp16 else torch.float32)
+            if device == "cuda":
+                # TF32 tensor cores for any matmul that still runs in FP32
+                torch.backends.cuda.matmul.allow_tf32 = True
+                torch.set_float32_matmul_precision("high")
             
             logger.info(f"Loading model {model_name} with dtype {dtype}...")
             # Stage 1: Model downloading/loading
@@ -99,63 +202,21 @@ class TrainingService:
             # Stage 3: Loading model weights
             await self._update_job_stage(db, job.id, "MODEL_LOADING", 40.0, "モデルの重みをメモリにロード中...", 180)
             
-            # Special memory-efficient loading for large models like Gemma2-2B
-            if "gemma-2-2b" in model_name:
-                logger.info("Loading model with memory optimizations for Gemma2-2B")
-                
-                # Try QLoRA if GPU is available, otherwise use CPU optimizations
-                if device == "cuda":
-                    try:
-                        from transformers import BitsAndBytesConfig
-                        bnb_config = BitsAndBytesConfig(
-                            load_in_4bit=True,
-                            bnb_4bit_use_double_quant=True,
-                            bnb_4bit_quant_type="nf4",
-                            bnb_4bit_compute_dtype=torch.float16,
-                        )
-                        logger.info("Using QLoRA (4-bit quantization) for GPU")
-                        model = AutoModelForCausalLM.from_pretrained(
-                            model_name,
-                            cache_dir=self.model_cache_dir,
-                            device_map="auto",
-                            quantization_config=bnb_config,
-                            trust_remote_code=True,
-                            token=os.environ.get('HF_TOKEN')
-                        )
-                    except Exception as e:
-                        logger.warning(f"QLoRA failed, falling back to standard loading: {e}")
-                        model = AutoModelForCausalLM.from_pretrained(
-                            model_name,
-                            cache_dir=self.model_cache_dir,
-                            device_map="auto",
-                            torch_dtype=torch.float16,
-                            trust_remote_code=True,
-                            token=os.environ.get('HF_TOKEN')
-                        )
-                else:
-                    # CPU optimizations
-                    logger.info("Using CPU optimizations (no quantization)")
-                    model = AutoModelForCausalLM.from_pretrained(
-                        model_name,
-                        cache_dir=self.model_cache_dir,
-                        torch_dtype=torch.float32,
-                        trust_remote_code=True,
-                        low_cpu_mem_usage=True,
-                        use_cache=False,
-                        token=os.environ.get('HF_TOKEN')
-                    )
+            cache_key = (model_name, str(dtype), device)
+            if cache_key in _base_model_cache and cache_key not in _base_models_in_use:
+                logger.info(f"♻️ Reusing cached base model {model_name}")
+                model = _base_model_cache[cache_key]
             else:
-                model = AutoModelForCausalLM.from_pretrained(
-                    model_name,
-                    cache_dir=self.model_cache_dir,
-                    device_map="auto" if device == "cuda" else None,
-                    torch_dtype=dtype,
-                    trust_remote_code=True
-                )
+                # 4-bit NF4 (QLoRA) base weights on GPU for every model over ~1B parameters
+                model = await asyncio.to_thread(self._load_base_model, model_name, device, dtype)
+                if cache_key in _base_models_in_use:
+                    cache_key = None  # Private copy, dropped after the job
+            if cache_key is not None:
+                _base_models_in_use.add(cache_key)
             logger.info("Model loaded successfully")
             
-            # Move model to appropriate device if not using device_map
-            if device == "cpu":
+            # from_pretrained without device_map already builds the model on CPU; only move it if it is elsewhere
+            if device == "cpu" and next(model.parameters()).device.type != "cpu":
                 model = model.to(device)
 
             # Prepare LoRA configuration with appropriate target modules
@@ -191,14 +252,8 @@ class TrainingService:
             # Stage 4: Applying LoRA configuration
             await self._update_job_stage(db, job.id, "LORA_CONFIG", 60.0, "LoRA設定を適用中...", 120)
             
-            model = get_peft_model(model, lora_config)
-            model.print_trainable_parameters()
-            
-            # Ensure model is in training mode and requires gradients
-            model.train()
-            for param in model.parameters():
-                if param.requires_grad:
-                    param.requires_grad_(True)
+            model = await asyncio.to_thread(self._apply_lora, model, lora_config, device)
+            self._log_trainable_parameters(model, (model_name, str(dtype), job.lora_config["r"], tuple(target_modules)))
             
             logger.info("LoRA configuration applied successfully")
 
@@ -207,12 +262,29 @@ class TrainingService:
             # Stage 5: Dataset preparation
             await self._update_job_stage(db, job.id, "DATASET_PREP", 75.0, "データセットを準備中...", 60)
             
-            train_dataset = self._prepare_dataset(dataset.data, tokenizer, job.training_config["max_length"])
-            logger.info(f"Dataset prepared with {len(train_dataset)} samples")
+            train_dataset = await asyncio.to_thread(
+                self._prepare_dataset, dataset.id, dataset.data, tokenizer, job.training_config["max_length"]
+            )
+            num_samples = len(dataset.data)
+            streaming = isinstance(train_dataset, IterableDataset)
+            logger.info(f"Dataset prepared with {num_samples} samples{' (streaming)' if streaming else ''}")
 
             # Memory-optimized training arguments for large models
             batch_size = 1 if "gemma-2-2b" in model_name else job.training_config["batch_size"]
             grad_accum = 8 if "gemma-2-2b" in model_name else job.training_config["gradient_accumulation_steps"]
+            # Reach the target global batch through accumulation so the optimizer steps less often
+            if TARGET_GLOBAL_BATCH > 0:
+                target_accum = self._compute_accum_steps(batch_size, num_samples)
+                if target_accum > grad_accum:
+                    logger.warning(
+                        f"LLMLORA_TARGET_BATCH={TARGET_GLOBAL_BATCH}: raising gradient_accumulation_steps "
+                        f"from {grad_accum} to {target_accum} (effective batch {batch_size * target_accum})"
+                    )
+                    grad_accum = target_accum
+            
+            # One optimizer step consumes batch_size * grad_accum samples
+            steps_per_epoch = math.ceil(num_samples / (batch_size * grad_accum))
+            total_steps = steps_per_epoch * job.training_config["num_epochs"]
             
             training_args = TrainingArguments(
                 output_dir=str(job_output_dir),
@@ -226,28 +298,39 @@ class TrainingService:
                 save_steps=job.training_config["save_steps"],
                 save_total_limit=2,  # Reduce to save disk space
                 remove_unused_columns=False,
-                dataloader_pin_memory=False,  # Disable for memory efficiency
-                dataloader_num_workers=0,  # Single threaded to reduce memory
+                # GPU: pinned batches and worker processes overlap collation/H2D copies with the step
+                dataloader_pin_memory=device == "cuda",
+                dataloader_num_workers=STREAMING_WORKERS if streaming else (DATALOADER_WORKERS if device == "cuda" else 0),
                 report_to=None,
                 # Gradient and optimization flags
-                gradient_checkpointing=False if "gemma-2-2b" in model_name else True,  # Disable for Gemma2 to fix gradient issues
-                optim="adamw_torch",  # More memory efficient optimizer
-                fp16=False,  # Use float32 for CPU stability
-                no_cuda=True if device == "cpu" else False,
-                use_cpu=True if device == "cpu" else False,
+                gradient_checkpointing=True,
+                # Non-reentrant checkpointing works with frozen inputs and compiled blocks
+                gradient_checkpointing_kwargs={"use_reentrant": False},
+                # Paged 8-bit AdamW: ~4x smaller optimizer state and no OOM spikes on long microbatches
+                optim="paged_adamw_8bit" if device == "cuda" and BNB_AVAILABLE else "adamw_torch",
+                bf16=bf16,
+                bf16_full_eval=bf16,
+                fp16=fp16,  # Float32 on CPU for stability
+                tf32=True if bf16 else None,  # BF16 support implies Ampere+, where TF32 is available
+                use_cpu=device == "cpu",  # no_cuda is a deprecated alias
                 logging_strategy="steps",
                 eval_strategy="no",  # Updated parameter name
                 # Gradient specific settings for Gemma2
                 max_grad_norm=1.0,  # Gradient clipping
+                group_by_length=not streaming,  # Batch similar lengths together so little padding is needed
+                length_column_name="length",  # Precomputed in _prepare_dataset; the sampler would otherwise scan every row
+                # Fixed step count: accurate progress and required for an IterableDataset (no length)
+                max_steps=total_steps,
                 adam_beta1=0.9,
                 adam_beta2=0.999,
                 adam_epsilon=1e-8,
             )
 
-            # Data collator
-            data_collator = DataCollatorForLanguageModeling(
+            # Data collator: pads per batch to a Tensor Core friendly multiple and sets labels (pad -> -100)
+            data_collator = LengthDroppingCollator(
                 tokenizer=tokenizer,
                 mlm=False,
+                pad_to_multiple_of=16 if bf16 else 8,
             )
 
             # Custom trainer with progress tracking
@@ -262,7 +345,7 @@ class TrainingService:
 
             # Clear status message and start training
             job.error_message = None
-            job.total_steps = len(train_dataset) // job.training_config["batch_size"] * job.training_config["num_epochs"]
+            job.total_steps = total_steps
             await db.commit()
             
             # Stage 6: Training start
@@ -270,15 +353,12 @@ class TrainingService:
             
             # Start training
             logger.info(f"Starting training for job {job.id} with {job.total_steps} total steps")
-            trainer.train()
+            final_model_path = job_output_dir / "final_model"
+            # Training and saving run in a worker thread so the event loop keeps serving API requests
+            await asyncio.to_thread(self._train_and_save, trainer, tokenizer, final_model_path)
             
             logger.info(f"Training completed for job {job.id}")
 
-            # Save final model
-            final_model_path = job_output_dir / "final_model"
-            trainer.save_model(str(final_model_path))
-            tokenizer.save_pretrained(str(final_model_path))
-
             # Update job completion
             job.status = TrainingStatus.COMPLETED
             job.completed_at = datetime.utcnow()
@@ -287,11 +367,191 @@ class TrainingService:
             await db.commit()
 
             logger.info(f"Training job {job.id} completed successfully")
+            succeeded = True
 
         except Exception as e:
             logger.error(f"Training failed for job {job.id}: {e}")
             raise
+        finally:
+            if cache_key is not None:
+                self._release_base_model(cache_key, model, reuse=succeeded)
+    
+    def _apply_lora(self, model, lora_config: LoraConfig, device: str):
+        """Wrap the base model with LoRA adapters and prepare it for training (blocking)"""
+        model = get_peft_model(model, lora_config)
+        
+        # Gradient checkpointing needs the embedding outputs to require grad when the base is frozen
+        # (this was the Gemma2 gradient issue), so enable it for every model
+        model.enable_input_require_grads()
+        
+        if device == "cuda" and TRAIN_COMPILE:
+            self._compile_layers(model)
+        
+        # Ensure model is in training mode (PEFT already marks only the LoRA weights trainable)
+        model.train()
+        return model
+    
+    def _train_and_save(self, trainer: "TrainerWithProgress", tokenizer, final_model_path: Path):
+        """Run the training loop and save the adapter and tokenizer (blocking)"""
+        try:
+            trainer.train()
+        finally:
+            trainer.metrics_writer.close()
+        
+        # Save final model
+        trainer.save_model(str(final_model_path))
+        tokenizer.save_pretrained(str(final_model_path))
+    
+    def _release_base_model(self, cache_key: tuple, model, reuse: bool):
+        """Strip this job's LoRA layers, hooks and compiled forwards and keep the clean base model for the next job"""
+        try:
+            # get_peft_model injects LoRA into the base in place, so a failed job may leave it half-modified
+            if not reuse or model is None:
+                _base_model_cache.pop(cache_key, None)
+                return
+            base_model = model.unload() if isinstance(model, PeftModel) else model
+            # enable_input_require_grads() registers a forward hook on the embeddings on every job
+            if getattr(base_model, "_require_grads_hook", None) is not None:
+                base_model.disable_input_require_grads()
+            for module in base_model.modules():
+                if getattr(module, "_llmlora_compiled", False):
+                    del module.forward  # Drop the compiled instance attribute; the class forward is used again
+                    del module._llmlora_compiled
+            _base_model_cache.put(cache_key, base_model, max_items=MAX_CACHED_BASE_MODELS)
+        except Exception as e:
+            logger.warning(f"Could not cache base model {cache_key[0]}: {e}")
+            _base_model_cache.pop(cache_key, None)
+        finally:
+            _base_models_in_use.discard(cache_key)
 
+    def _load_base_model(self, model_name: str, device: str, dtype: torch.dtype):
+        """Load the frozen base model; large models get 4-bit NF4 + double quantization on GPU (QLoRA)"""
+        load_kwargs = dict(
+            cache_dir=self.model_cache_dir,
+            trust_remote_code=True,
+            low_cpu_mem_usage=True,  # Load weights directly in the target dtype, no FP32 shadow copy
+            use_cache=False,  # KV cache is useless in training and conflicts with gradient checkpointing
+            token=os.environ.get('HF_TOKEN')
+        )
+        
+        if device == "cuda":
+            if TRAIN_QUANT == "auto":
+                param_count = self._estimate_param_count(model_name)
+                quantize = param_count > QLORA_MIN_PARAMS
+            else:
+                param_count = 0
+                quantize = TRAIN_QUANT == "nf4"
+            if BNB_AVAILABLE and quantize:
+                try:
+                    from transformers import BitsAndBytesConfig
+                    bnb_config = BitsAndBytesConfig(
+                        load_in_4bit=True,
+                        bnb_4bit_use_double_quant=True,
+                        bnb_4bit_quant_type="nf4",
+                        bnb_4bit_compute_dtype=dtype,
+                    )
+                    logger.info(f"Using QLoRA (4-bit NF4) for {model_name}" + (f" (~{param_count / 1e9:.1f}B params)" if param_count else ""))
+                    model = self._from_pretrained(
+                        model_name,
+                        device,
+                        dtype,
+                        device_map="auto",
+                        quantization_config=bnb_config,
+                        **load_kwargs
+                    )
+                    # Casts norms to FP32 and enables input grads so checkpointing works on the frozen 4-bit base
+                    return prepare_model_for_kbit_training(model, use_gradient_checkpointing=True)
+                except Exception as e:
+                    logger.warning(f"QLoRA failed, falling back to standard loading: {e}")
+            return self._from_pretrained(model_name, device, dtype, device_map="auto", **load_kwargs)
+        
+        # CPU: FP32 without quantization
+        return self._from_pretrained(model_name, device, dtype, **load_kwargs)
+    
+    def _from_pretrained(self, model_name: str, device: str, dtype: torch.dtype, **kwargs):
+        """from_pretrained with the fastest supported attention kernel, retrying with the model default"""
+        attn_implementation = self._attn_implementation(device, dtype)
+        try:
+            return AutoModelForCausalLM.from_pretrained(
+                model_name,
+                torch_dtype=dtype,
+                attn_implementation=attn_implementation,
+                **kwargs
+            )
+        except (ValueError, ImportError) as e:
+            logger.warning(f"{attn_implementation} attention not supported for {model_name}, using default attention: {e}")
+            return AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=dtype, **kwargs)
+    
+    @staticmethod
+    def _attn_implementation(device: str, dtype: torch.dtype) -> str:
+        """FlashAttention-2 on Ampere+ GPUs with half precision and flash-attn installed, otherwise SDPA"""
+        if (
+            FLASH_ATTN_AVAILABLE
+            and device == "cuda"
+            and dtype in (torch.bfloat16, torch.float16)
+            and torch.cuda.get_device_capability()[0] >= 8
+        ):
+            return "flash_attention_2"
+        return "sdpa"
+    
+    def _estimate_param_count(self, model_name: str) -> int:
+        """Rough parameter count from the model config (no weights are downloaded)"""
+        try:
+            config = AutoConfig.from_pretrained(
+                model_name,
+                cache_dir=self.model_cache_dir,
+                trust_remote_code=True,
+                token=os.environ.get('HF_TOKEN')
+            )
+            hidden = getattr(config, "hidden_size", None) or getattr(config, "n_embd", 0)
+            layers = getattr(config, "num_hidden_layers", None) or getattr(config, "n_layer", 0)
+            intermediate = getattr(config, "intermediate_size", None) or 4 * hidden
+            # Attention (4 h^2) + MLP (up to 3 h*i for gated MLPs) per layer, plus embeddings
+            return layers * (4 * hidden * hidden + 3 * hidden * intermediate) + config.vocab_size * hidden
+        except Exception as e:
+            logger.warning(f"Could not estimate size of {model_name}: {e}")
+            return 0
+    
+    def _compute_accum_steps(self, per_device_bs: int, num_samples: int, target_global_bs: int = TARGET_GLOBAL_BATCH) -> int:
+        """Gradient accumulation steps that reach target_global_bs without starving small datasets of updates"""
+        accum = max(1, target_global_bs // per_device_bs)
+        return max(1, min(accum, num_samples // (per_device_bs * MIN_STEPS_PER_EPOCH)))
+    
+    def _log_trainable_parameters(self, model, key: tuple):
+        """Log trainable vs total parameters; the full parameter walk runs once per base model + LoRA shape"""
+        if key not in _trainable_param_counts:
+            with torch.no_grad():
+                trainable = sum(p.numel() for p in model.parameters() if p.requires_grad)
+                total = sum(p.numel() for p in model.parameters())
+            _trainable_param_counts[key] = (trainable, total)
+        trainable, total = _trainable_param_counts[key]
+        logger.info(f"trainable params: {trainable:,} || all params: {total:,} || trainable%: {100 * trainable / max(total, 1):.4f}")
+    
+    def _compile_layers(self, model):
+        """torch.compile each decoder block's forward in place (regional compilation)"""
+        try:
+            import torch._dynamo
+            # Graph breaks / unsupported ops fall back to eager instead of failing the job
+            torch._dynamo.config.suppress_errors = True
+            # The decoder stack is the largest ModuleList of identical blocks
+            layers = max(
+                (m for m in model.modules() if isinstance(m, torch.nn.ModuleList) and len({type(b) for b in m}) == 1),
+                key=len,
+                default=None
+            )
+            if not layers:
+                logger.info("No repeated decoder blocks found, training in eager mode")
+                return
+            # Compiling the bound forward keeps parameter names (and the saved LoRA adapter keys) unchanged
+            for layer in layers:
+                if getattr(layer, "_llmlora_compiled", False):
+                    continue  # Already compiled
+                layer.forward = torch.compile(layer.forward)
+                layer._llmlora_compiled = True
+            logger.info(f"⚡ torch.compile enabled for {len(layers)} {type(layers[0]).__name__} blocks")
+        except Exception as e:
+            logger.warning(f"torch.compile unavailable, training in eager mode: {e}")
+    
     def _resolve_model_name(self, model_name: str) -> str:
         """Resolve Ollama model name to HuggingFace model name"""
         # Map common Ollama models to HuggingFace equivalents
@@ -323,81 +583,136 @@ class TrainingService:
         return model_mapping.get(model_name, "rinna/japanese-gpt-neox-3.6b-instruction-sft")
 
     def _get_target_modules(self, model_name: str, requested_modules: list) -> list:
-        """Get appropriate target modules for the given model"""
-        # Define target modules for different model architectures
-        model_modules = {
-            # GPT-2 based models (DialoGPT)
-            "microsoft/DialoGPT": ["c_attn", "c_proj"],
-            
-            # Japanese models (GPT-NeoX architecture)
-            "rinna/japanese-gpt-neox": ["query_key_value", "dense"],
-            "rinna/japanese-gpt-1b": ["c_attn", "c_proj"],  # GPT-2 architecture
-            "cyberagent/open-calm": ["query_key_value", "dense"],
-            
-            # LLaMA based models
-            "meta-llama": ["q_proj", "v_proj", "k_proj", "o_proj"],
-            "mistralai": ["q_proj", "v_proj", "k_proj", "o_proj"],
-            
-            # Gemma models (specific architecture)
-            "google/gemma-2": ["q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj"],
-            "google/gemma": ["q_proj", "v_proj", "k_proj", "o_proj"],
-        }
+        """Get appropriate target modules for the given model (longest matching name prefix wins)"""
+        return next(
+            (modules for prefix, modules in LORA_TARGET_MODULES if model_name.startswith(prefix)),
+            DEFAULT_TARGET_MODULES
+        )
+
+    def _prepare_dataset(self, dataset_id: int, data: list, tokenizer, max_length: int) -> Union[HFDataset, IterableDataset]:
+        """Prepare dataset for training (tokenized output is cached as Arrow and reused across jobs)"""
+        streaming = len(data) >= STREAMING_MIN_SAMPLES
         
-        # Find matching modules based on model name
-        for model_prefix, modules in model_modules.items():
-            if model_prefix in model_name:
-                return modules
-                
-        # Default fallback for GPT-2 based models (most common)
-        return ["c_attn", "c_proj"]
-
-    def _prepare_dataset(self, data: list, tokenizer, max_length: int) -> HFDataset:
-        """Prepare dataset for training"""
-        # Prepare text data with appropriate formatting for DialoGPT
-        texts = []
-        for item in data:
-            if "instruction" in item and "output" in item:
-                # Format for Japanese instruction-response pairs
-                text = f"User: {item['instruction']} Bot: {item['output']}<|endoftext|>"
-            elif "input" in item and "output" in item:
-                # Format for simple input-output pairs
-                text = f"User: {item['input']} Bot: {item['output']}<|endoftext|>"
-            elif "question" in item and "answer" in item:
-                # Format for Q&A pairs
-                text = f"User: {item['question']} Bot: {item['answer']}<|endoftext|>"
-            else:
-                # Generic text format
-                text = f"User: {str(item)} Bot: こんにちは<|endoftext|>"
-            texts.append(text)
+        # In-memory datasets have no stable fingerprint, so name the cache directory after the dataset contents,
+        # max_length and tokenizer (name + vocab hash); later jobs on the same data load it instead of re-tokenizing.
+        # A directory (save_to_disk) rather than one cache_file_name: with num_proc > 1 map() writes one Arrow
+        # shard per process, so a single-file check would never hit for large datasets.
+        if not streaming:
+            cache_dir = Path(self.output_dir) / "dataset_cache"
+            cache_dir.mkdir(exist_ok=True)
+            content_hash = hashlib.sha1(
+                json.dumps(data, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")
+            ).hexdigest()[:12]
+            tokenizer_name = tokenizer.name_or_path.replace("/", "_")
+            cache_path = cache_dir / (
+                f"ds_v{DATASET_CACHE_VERSION}_{dataset_id}_{content_hash}_{max_length}_"
+                f"{tokenizer_name}_{self._tokenizer_fingerprint(tokenizer)}"
+            )
+            if cache_path.is_dir():
+                # Cache hit: memory-map the tokenized shards and skip formatting/tokenization entirely
+                logger.info(f"📦 Using cached tokenized dataset: {cache_path.name}")
+                os.utime(cache_path)  # Mark as recently used for pruning
+                return HFDataset.load_from_disk(str(cache_path))
+        
+        # Build the Arrow table straight from the records and detect the schema once
+        raw_dataset = HFDataset.from_list(data)
+        column_names = raw_dataset.column_names
+        columns = next(
+            ((prompt, response) for prompt, response in PROMPT_RESPONSE_COLUMNS
+             if prompt in column_names and response in column_names),
+            None
+        )
+        num_proc = min(os.cpu_count() or 1, max(1, len(data) // 1000))
+        
+        def format_function(batch):
+            # Prepare text data with appropriate formatting for DialoGPT
+            if columns:
+                # instruction/output, input/output or question/answer pairs
+                return {"text": [
+                    f"User: {prompt} Bot: {response}<|endoftext|>"
+                    for prompt, response in zip(batch[columns[0]], batch[columns[1]])
+                ]}
+            # Generic text format
+            rows = [dict(zip(column_names, values)) for values in zip(*(batch[name] for name in column_names))]
+            return {"text": [f"User: {str(row)} Bot: こんにちは<|endoftext|>" for row in rows]}
         
         def tokenize_function(examples):
-            # Tokenize each text
+            # Tokenize each text without padding; the collator pads each batch and builds the labels
             tokenized = tokenizer(
                 examples["text"],
                 truncation=True,
-                padding=True,
                 max_length=max_length,
                 return_tensors=None,
             )
-            
-            # Set labels same as input_ids for causal LM
-            tokenized["labels"] = [input_ids.copy() for input_ids in tokenized["input_ids"]]
-            
+            # Token counts for group_by_length bucketing (LengthDroppingCollator strips them from each batch)
+            tokenized["length"] = [len(ids) for ids in tokenized["input_ids"]]
             return tokenized
-
-        # Create dataset with text column
-        dataset_dict = {"text": texts}
-        hf_dataset = HFDataset.from_dict(dataset_dict)
         
-        # Apply tokenization
-        tokenized_dataset = hf_dataset.map(
+        if streaming:
+            # Large corpora: format and tokenize lazily per batch; memory stays O(batch) instead of O(N x max_length)
+            return (
+                raw_dataset.to_iterable_dataset(num_shards=STREAMING_WORKERS)
+                .shuffle(seed=42, buffer_size=1000)
+                .map(format_function, batched=True, remove_columns=column_names)
+                .map(tokenize_function, batched=True, remove_columns=["text"])
+            )
+        
+        # Format and tokenize column-wise in Arrow (multi-process only when there is enough data to amortize worker startup)
+        tokenized_dataset = raw_dataset.map(
+            format_function,
+            batched=True,
+            remove_columns=column_names,
+            num_proc=num_proc
+        ).map(
             tokenize_function,
             batched=True,
-            remove_columns=["text"]
+            batch_size=1000,
+            remove_columns=["text"],
+            num_proc=num_proc
         )
         
+        # Write to a temporary directory and rename it, so a crashed or concurrent job never leaves a partial cache
+        tmp_path = cache_dir / f"{cache_path.name}.tmp{os.getpid()}"
+        try:
+            tokenized_dataset.save_to_disk(str(tmp_path), num_proc=num_proc)
+            os.replace(tmp_path, cache_path)
+            self._prune_dataset_cache(cache_dir)
+        except OSError as e:
+            logger.warning(f"Could not cache tokenized dataset {cache_path.name}: {e}")
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        
         return tokenized_dataset
-
+    
+    @staticmethod
+    def _prune_dataset_cache(cache_dir: Path):
+        """Remove tokenized datasets beyond the MAX_CACHED_DATASETS most recently used, and any from older cache versions"""
+        current_prefix = f"ds_v{DATASET_CACHE_VERSION}_"
+        entries = [
+            path for path in cache_dir.iterdir()
+            if path.name.startswith("ds_v") and ".tmp" not in path.name  # In-progress saves belong to running jobs
+        ]
+        current = sorted(
+            (path for path in entries if path.is_dir() and path.name.startswith(current_prefix)),
+            key=lambda path: path.stat().st_mtime,
+            reverse=True
+        )
+        stale = [path for path in entries if path not in current] + current[MAX_CACHED_DATASETS:]
+        for path in stale:
+            logger.info(f"🗑️ Pruning cached tokenized dataset: {path.name}")
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink(missing_ok=True)
+    
+    @staticmethod
+    def _tokenizer_fingerprint(tokenizer) -> str:
+        """Short hash of the vocabulary and special tokens, so a re-published tokenizer under the same name misses the cache"""
+        payload = json.dumps(
+            [sorted(tokenizer.get_vocab().items()), tokenizer.all_special_tokens],
+            ensure_ascii=False
+        )
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:8]
+    
     async def _update_job_error(self, db: AsyncSession, job_id: int, error_message: str):
         """Update job with error status"""
         try:
@@ -433,74 +748,146 @@ class TrainingService:
             logger.error(f"Failed to update job stage: {e}")
             await db.rollback()
 
-class TrainerWithProgress(Trainer):
-    """Custom trainer that tracks progress to database"""
+class LengthDroppingCollator(DataCollatorForLanguageModeling):
+    """Causal LM collator that drops the precomputed "length" column"""
     
-    def __init__(self, job_id: int, db_session: AsyncSession, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.job_id = job_id
-        self.db_session = db_session
+    def __call__(self, features, return_tensors=None):
+        # remove_unused_columns=False keeps every dataset column, and the model forward rejects a length keyword
+        features = [{key: value for key, value in feature.items() if key != "length"} for feature in features]
+        return super().__call__(features, return_tensors)
 
-    def log(self, logs: Dict[str, float]) -> None:
-        """Override log method to save metrics to database"""
-        super().log(logs)
-        
-        # Save metrics to database synchronously to avoid session conflicts
+class MetricsWriter:
+    """Persists training metrics and progress from a background thread so Trainer.log() never waits on the DB"""
+    
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=METRICS_QUEUE_SIZE)
+        self._metric_buffer: List[Dict[str, Any]] = []  # TrainingMetrics rows not yet inserted
+        self._last_metrics_flush = time.monotonic()
+        self._last_progress_write = 0.0
+        self._last_progress = None  # progress value of the last job UPDATE
+        self._thread = threading.Thread(target=self._run, name=f"metrics-job-{job_id}", daemon=True)
+        self._thread.start()
+    
+    def put(self, record: Dict[str, Any]):
         try:
-            import asyncio
-            loop = asyncio.get_event_loop()
-            if loop.is_running():
-                # If we're in an async context, schedule the update
-                asyncio.create_task(self._save_metrics_safely(logs))
-            else:
-                # Run synchronously
-                loop.run_until_complete(self._save_metrics_safely(logs))
-        except Exception as e:
-            logger.error(f"Failed to schedule metrics save: {e}")
-
-    async def _save_metrics_safely(self, logs: Dict[str, float]):
-        """Save training metrics to database with separate session"""
+            self._queue.put_nowait(record)
+        except queue.Full:
+            logger.warning(f"Metrics queue full for job {self.job_id}, dropping step {record.get('step')}")
+    
+    def close(self, timeout: float = 30.0):
+        """Flush everything queued so far and stop the writer thread"""
+        self._queue.put(None, timeout=timeout)
+        self._thread.join(timeout)
+    
+    def _run(self):
+        stopped = False
+        while not stopped:
+            # Block for the next record, then drain whatever else piled up
+            records = []
+            item = self._queue.get()
+            while True:
+                if item is None:
+                    stopped = True
+                else:
+                    records.append(item)
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if records or stopped:
+                self._write(records, final=stopped)
+    
+    def _write(self, records: List[Dict[str, Any]], final: bool = False):
+        self._metric_buffer.extend(
+            {
+                "job_id": self.job_id,
+                "step": r["step"],
+                "epoch": r["epoch"],
+                "loss": r["loss"],
+                "learning_rate": r["learning_rate"],
+            }
+            for r in records
+        )
+        flush_metrics = bool(self._metric_buffer) and (
+            final
+            or len(self._metric_buffer) >= METRICS_FLUSH_ROWS
+            or time.monotonic() - self._last_metrics_flush >= METRICS_FLUSH_INTERVAL
+        )
+        # Progress is what the UI polls, so it is written at most every PROGRESS_WRITE_INTERVAL seconds
+        # and only when it moved by PROGRESS_MIN_DELTA (or PROGRESS_MAX_INTERVAL passed); the final state is always written
+        write_progress = False
+        if records:
+            since_write = time.monotonic() - self._last_progress_write
+            moved = self._last_progress is None or abs(records[-1]["progress"] - self._last_progress) >= PROGRESS_MIN_DELTA
+            write_progress = final or (since_write >= PROGRESS_WRITE_INTERVAL and (moved or since_write >= PROGRESS_MAX_INTERVAL))
+        if not flush_metrics and not write_progress:
+            return
+        
+        # The sync engine is used here: async engine connections are bound to the main event loop
         try:
-            # Use a new database session to avoid conflicts
-            async with AsyncSessionLocal() as new_session:
-                if "loss" in logs and "epoch" in logs:
-                    # Save metric
-                    metric = DBTrainingMetrics(
-                        job_id=self.job_id,
-                        step=self.state.global_step,
-                        epoch=int(logs["epoch"]),
-                        loss=logs["loss"],
-                        learning_rate=logs.get("learning_rate", 0),
-                    )
-                    
-                    new_session.add(metric)
-                    
-                    # Update job progress - use step-based calculation for more frequent updates
-                    if self.state.max_steps > 0:
-                        progress = (self.state.global_step / self.state.max_steps) * 100
-                    else:
-                        # Fallback to epoch-based calculation
-                        progress = (logs["epoch"] / self.args.num_train_epochs) * 100
-                    await new_session.execute(
+            with SessionLocal() as db:
+                if db.bind.dialect.name == "postgresql":
+                    # Telemetry only: don't wait for the WAL flush on commit (a crash loses at most the last few rows)
+                    db.execute(text("SET LOCAL synchronous_commit = off"))
+                if flush_metrics:
+                    # Core executemany insert: no ORM identity-map work per row
+                    db.execute(insert(DBTrainingMetrics.__table__), self._metric_buffer)
+                
+                if write_progress:
+                    # Only the latest progress matters
+                    last = records[-1]
+                    db.execute(
                         update(TrainingJob)
                         .where(TrainingJob.id == self.job_id)
                         .values(
-                            progress=progress,
-                            current_epoch=int(logs["epoch"]),
-                            current_step=self.state.global_step,
-                            total_steps=self.state.max_steps,
-                            loss=logs["loss"]
+                            progress=last["progress"],
+                            current_epoch=last["epoch"],
+                            current_step=last["step"],
+                            total_steps=last["max_steps"],
+                            loss=last["loss"]
                         )
                     )
-                    
-                    await new_session.commit()
-                    logger.info(f"Progress updated: {progress:.1f}% (Epoch {int(logs['epoch'])}/{self.args.num_train_epochs}, Step {self.state.global_step}/{self.state.max_steps}, Loss: {logs['loss']:.4f})")
-                
+                # Metric rows and the progress UPDATE share one transaction: a single commit per flush
+                db.commit()
+            if flush_metrics:
+                # Cleared only after the commit so a failed flush is retried with the next batch
+                self._metric_buffer = []
+                self._last_metrics_flush = time.monotonic()
+            if write_progress:
+                self._last_progress_write = time.monotonic()
+                self._last_progress = last["progress"]
+                logger.info(f"Progress updated: {last['progress']:.1f}% (Epoch {last['epoch']}, Step {last['step']}/{last['max_steps']}, Loss: {last['loss']:.4f})")
         except Exception as e:
             logger.error(f"Failed to save metrics: {e}")
-            import traceback
-            logger.error(f"Traceback: {traceback.format_exc()}")
+            # Keep retrying, but never hold more than METRICS_QUEUE_SIZE rows while the DB is unavailable
+            del self._metric_buffer[:-METRICS_QUEUE_SIZE]
+
+class TrainerWithProgress(Trainer):
+    """Custom trainer that tracks progress to database"""
     
-    async def _save_metrics(self, logs: Dict[str, float]):
-        """Legacy method for backward compatibility"""
-        await self._save_metrics_safely(logs)
\ No newline at end of file
+    def __init__(self, job_id: int, db_session: AsyncSession, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.job_id = job_id
+        self.db_session = db_session
+        self.metrics_writer = MetricsWriter(job_id)
+
+    def log(self, logs: Dict[str, float]) -> None:
+        """Override log method to queue metrics for the background writer (O(1) on the training thread)"""
+        super().log(logs)
+        
+        if "loss" in logs and "epoch" in logs:
+            # Update job progress - use step-based calculation for more frequent updates
+            if self.state.max_steps > 0:
+                progress = (self.state.global_step / self.state.max_steps) * 100
+            else:
+                # Fallback to epoch-based calculation
+                progress = (logs["epoch"] / self.args.num_train_epochs) * 100
+            self.metrics_writer.put({
+                "step": self.state.global_step,
+                "epoch": int(logs["epoch"]),
+                "loss": logs["loss"],
+                "learning_rate": logs.get("learning_rate", 0),
+                "progress": progress,
+                "max_steps": self.state.max_steps,
+            })
@@ -0,0 +1,47 @@
+import os
+from typing import Optional
+from loguru import logger
+from services.ollama_service import ollama_service, json_body, json_loads
+
+class VLLMService:
+    """OpenAI-compatible completions client for a colocated vLLM/TGI server (enabled by VLLM_URL)"""
+
+    def __init__(self):
+        self.base_url: Optional[str] = os.getenv("VLLM_URL")  # e.g. http://vllm:8000
+        # Share the process-wide pooled client instead of opening another connection pool
+        self.client = ollama_service.client
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.base_url)
+
+    async def generate(self, model_name: str, prompt: str, temperature: float = 0.7, max_tokens: int = 512, **kwargs) -> str:
+        try:
+            response = await self.client.post(
+                f"{self.base_url.rstrip('/')}/v1/completions",
+                **json_body({
+                    "model": model_name,
+                    "prompt": prompt,
+                    "temperature": temperature,
+                    "max_tokens": max_tokens,
+                    **kwargs
+                })
+            )
+            response.raise_for_status()
+            choices = json_loads(response.content).get("choices", [])
+            return choices[0].get("text", "") if choices else ""
+        except Exception as e:
+            logger.error(f"Error generating with vLLM model {model_name}: {e}")
+            raise Exception(f"Failed to generate: {e}")
+
+    async def health_check(self) -> bool:
+        if not self.enabled:
+            return False
+        try:
+            response = await self.client.get(f"{self.base_url.rstrip('/')}/health")
+            return response.status_code == 200
+        except Exception as e:
+            logger.error(f"vLLM health check failed: {e}")
+            return False
+
+vllm_service = VLLMService()
@@ -9,7 +9,7 @@ import json
 import time
 import sys
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Optional
 
 class TutorialTester:
     def __init__(self, base_url: str = "http://localhost:8000"):
@@ -163,13 +163,26 @@ class TutorialTester:
         last_status = None
         last_progress = None
         
-        while time.time() - start_time < max_wait_time:
-            try:
-                response = self.session.get(f"{self.base_url}/training/jobs/{job_id}", timeout=10)
-                if response.status_code == 200:
-                    job_info = response.json()
+        try:
+            # Server-Sent Events: the backend pushes a line whenever status/progress changes (keep-alive every 15s)
+            with self.session.get(
+                f"{self.base_url}/training/jobs/{job_id}/events",
+                stream=True,
+                timeout=(5, 30)
+            ) as response:
+                if response.status_code != 200:
+                    self.error(f"ジョブ情報取得失敗: {response.status_code}")
+                    return False
+                
+                for line in response.iter_lines(decode_unicode=True):
+                    if time.time() - start_time >= max_wait_time:
+                        break
+                    if not line or not line.startswith("data: "):
+                        continue  # 空行・keep-aliveコメント
+                    
+                    job_info = json.loads(line[6:])
                     status = job_info.get('status', 'unknown')
-                    progress = job_info.get('progress', 0)
+                    progress = job_info.get('progress') or 0
                     
                     # ステータスまたは進捗が変わった場合のみ表示
                     if status != last_status or abs(progress - (last_progress or 0)) > 5:
@@ -181,21 +194,16 @@ class TutorialTester:
                         self.success(f"訓練ジョブ {job_id} が完了しました")
                         return True
                     elif status == 'failed':
-                        error_msg = job_info.get('error_message', '不明なエラー')
+                        error_msg = job_info.get('error_message') or '不明なエラー'
                         self.error(f"訓練ジョブ {job_id} が失敗: {error_msg}")
                         return False
-                    elif status in ['pending', 'running']:
-                        time.sleep(5)  # 5秒待機
-                    else:
+                    elif status not in ['pending', 'running']:
                         self.warning(f"不明なステータス: {status}")
-                        time.sleep(5)
-                else:
-                    self.error(f"ジョブ情報取得失敗: {response.status_code}")
-                    return False
-                    
-            except requests.exceptions.RequestException as e:
-                self.error(f"ジョブ監視エラー: {e}")
-                return False
+                        return False
+        
+        except requests.exceptions.RequestException as e:
+            self.error(f"ジョブ監視エラー: {e}")
+            return False
         
         self.warning(f"訓練ジョブ {job_id} がタイムアウトしました")
         return False
@@ -4,95 +4,291 @@ LoRAファインチューニングプラットフォーム - データセット
 チュートリアル用データセットの形式と品質を検証します
 """
 
+import argparse
 import json
 import sys
 import os
-from pathlib import Path
-from typing import Dict, List, Any
-import statistics
+import functools
+import mmap
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Any, Iterable, Optional
+from array import array
+
+# orjson（SIMD対応パーサ）があれば使用し、なければ標準のjsonにフォールバック
+try:
+    import orjson
+    json_loads = orjson.loads
+    ORJSON_AVAILABLE = True
+except ImportError:
+    json_loads = json.loads
+    ORJSON_AVAILABLE = False
+
+# ijsonがあれば大きなファイルを逐次パース（配列全体をPythonオブジェクトに展開しない）
+try:
+    import ijson
+    IJSON_AVAILABLE = True
+except ImportError:
+    IJSON_AVAILABLE = False
+
+# NumPyがあれば長さ統計をベクトル化（array('i')のバッファをコピーせずに参照）
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# pybloom_liveがあれば、ストリーミング時の重複検出をBloomフィルタ＋候補の厳密確認で行う
+# （逐次パースでは捨てられるはずの文字列を、重複チェックのためだけに全件保持しない）
+try:
+    from pybloom_live import ScalableBloomFilter
+    BLOOM_AVAILABLE = True
+except ImportError:
+    BLOOM_AVAILABLE = False
+
+# xxhashがあれば、Bloomフィルタを使わないストリーミング時は文字列の代わりに64bitハッシュで重複を数える
+try:
+    from xxhash import xxh64_intdigest
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
+
+JSON_ERRORS = (json.JSONDecodeError, ijson.JSONError) if IJSON_AVAILABLE else (json.JSONDecodeError,)
+
+# このサイズ以上のファイルはストリーミングで1パス検証
+STREAMING_THRESHOLD_BYTES = 50 * 1024 * 1024
+
+# 表示するエントリ単位のエラーの上限（残りは件数のみ表示し、メッセージも組み立てない）
+MAX_REPORTED_ERRORS = 20
+
+# 合計サイズがこれ以上ならファイルごとの走査をプロセス並列で実行（小さいファイルでは起動コストの方が大きい）
+PARALLEL_MIN_BYTES = 1 * 1024 * 1024
+
+class DatasetFormatError(Exception):
+    """トップレベルがリストでないなど、エントリを走査できない形式"""
+
+COLORS = {
+    "red": "\033[0;31m",
+    "green": "\033[0;32m", 
+    "yellow": "\033[1;33m",
+    "blue": "\033[0;34m",
+    "white": "\033[0m"
+}
+LINE_END = "\033[0m\n"
+
+# 色＋記号のプレフィックスは起動時に1回だけ組み立てる
+SUCCESS_PREFIX = f"{COLORS['green']}✅ "
+WARNING_PREFIX = f"{COLORS['yellow']}⚠️  "
+ERROR_PREFIX = f"{COLORS['red']}❌ "
+INFO_PREFIX = f"{COLORS['blue']}ℹ️  "
+
+# 出力はバッファにためてflush_output()でまとめて書き出す（1行ごとのprint/syscallを避ける）
+_output: List[str] = []
+
+def emit(text: str):
+    """バッファに1行追加"""
+    _output.append(text)
+    _output.append("\n")
+
+def flush_output():
+    """ためた出力を1回のwriteで書き出す"""
+    sys.stdout.write("".join(_output))
+    sys.stdout.flush()
+    _output.clear()
 
 def print_colored(message: str, color: str = "white"):
     """色付きメッセージを出力"""
-    colors = {
-        "red": "\033[0;31m",
-        "green": "\033[0;32m", 
-        "yellow": "\033[1;33m",
-        "blue": "\033[0;34m",
-        "white": "\033[0m"
-    }
-    reset = "\033[0m"
-    print(f"{colors.get(color, colors['white'])}{message}{reset}")
+    _output.extend((COLORS.get(color, COLORS["white"]), message, LINE_END))
 
 def success(message: str):
-    print_colored(f"✅ {message}", "green")
+    _output.extend((SUCCESS_PREFIX, message, LINE_END))
 
 def warning(message: str):
-    print_colored(f"⚠️  {message}", "yellow")
+    _output.extend((WARNING_PREFIX, message, LINE_END))
 
 def error(message: str):
-    print_colored(f"❌ {message}", "red")
+    _output.extend((ERROR_PREFIX, message, LINE_END))
 
 def info(message: str):
-    print_colored(f"ℹ️  {message}", "blue")
+    _output.extend((INFO_PREFIX, message, LINE_END))
 
-def validate_json_structure(data: List[Dict[str, Any]], filename: str) -> bool:
-    """JSONデータの構造を検証"""
-    if not isinstance(data, list):
-        error(f"{filename}: データはリスト形式である必要があります")
-        return False
-    
-    if len(data) == 0:
-        error(f"{filename}: データが空です")
-        return False
+def info_lines(messages: List[str]):
+    """複数行のinfoを1つの文字列に結合して追加"""
+    _output.append("".join(f"{INFO_PREFIX}{message}{LINE_END}" for message in messages))
+
+def scan_entries(entries: Iterable[Any], filename: str, fast: bool = False,
+                 use_bloom: bool = False, hash_keys: bool = False, diversity: bool = True) -> Dict[str, Any]:
+    """エントリを1回だけ走査し、構造検証・長さ統計・重複/語彙集計をまとめて行う（fastなら最初のエラーで打ち切り）
     
-    required_fields = ["instruction", "output"]
+    use_bloomの場合、重複数は確定せず候補だけを "duplicate_candidates" に返す（confirm_duplicatesで確定）
+    hash_keysの場合、重複チェックの集合には文字列ではなくxxh64の整数値を入れる（衝突は実用上無視できる）
+    diversityがFalseなら重複・語彙の集計（split/集合の構築）を行わない
+    """
+    use_bloom = use_bloom and diversity
+    entry_count = 0
     valid_entries = 0
+    errors: List[str] = []  # 先頭MAX_REPORTED_ERRORS件のエラー（キャッシュから再表示できるよう出力せずに保持）
+    # 長さは4バイトintの連続領域に格納（boxedなint 28バイト/件のリストを作らない）
+    instruction_lengths = array('i')
+    output_lengths = array('i')
+    append_instruction_length = instruction_lengths.append
+    append_output_length = output_lengths.append
+    # 重複はセットへの追加時にその場で数える（リスト→setの変換をしない）
+    unique_instructions = set()
+    unique_outputs = set()
+    duplicate_instructions = 0
+    duplicate_outputs = 0
+    if use_bloom:
+        # Bloomフィルタに既出と判定された文字列（真の重複＋まれな偽陽性）だけを保持
+        seen_instructions = ScalableBloomFilter(initial_capacity=10000, error_rate=1e-4)
+        seen_outputs = ScalableBloomFilter(initial_capacity=10000, error_rate=1e-4)
+    all_words = set()
+    total_words = 0
+    stopped_early = False
     
-    for i, entry in enumerate(data):
+    for i, entry in enumerate(entries):
+        # 前のエントリでエラーが出ていれば残りは読まない（ijson使用時はパースも打ち切られる）
+        if fast and entry_count > valid_entries:
+            stopped_early = True
+            break
+        entry_count += 1
         if not isinstance(entry, dict):
-            error(f"{filename}: エントリ {i+1} は辞書形式である必要があります")
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append(f"{filename}: エントリ {i+1} は辞書形式である必要があります")
             continue
-            
-        missing_fields = [field for field in required_fields if field not in entry]
-        if missing_fields:
-            error(f"{filename}: エントリ {i+1} に必要なフィールドがありません: {missing_fields}")
+        
+        # 各フィールドは1回だけ参照し、リストはエラー時のみ組み立てる
+        instruction = entry.get("instruction")
+        output = entry.get("output")
+        if instruction is None or output is None:
+            if len(errors) < MAX_REPORTED_ERRORS:
+                missing_fields = [field for field, value in (("instruction", instruction), ("output", output)) if value is None]
+                errors.append(f"{filename}: エントリ {i+1} に必要なフィールドがありません: {missing_fields}")
             continue
-            
+        
         # 空文字列チェック
-        empty_fields = [field for field in required_fields if not entry[field].strip()]
-        if empty_fields:
-            error(f"{filename}: エントリ {i+1} に空のフィールドがあります: {empty_fields}")
+        instruction_empty = not instruction.strip()
+        output_empty = not output.strip()
+        if instruction_empty or output_empty:
+            if len(errors) < MAX_REPORTED_ERRORS:
+                empty_fields = [field for field, empty in (("instruction", instruction_empty), ("output", output_empty)) if empty]
+                errors.append(f"{filename}: エントリ {i+1} に空のフィールドがあります: {empty_fields}")
             continue
-            
+        
         valid_entries += 1
+        append_instruction_length(len(instruction))
+        append_output_length(len(output))
+        if not diversity:
+            continue
+        if use_bloom:
+            # add()は既にフィルタに含まれていればTrue
+            if seen_instructions.add(instruction):
+                unique_instructions.add(instruction)
+            if seen_outputs.add(output):
+                unique_outputs.add(output)
+        else:
+            instruction_key = xxh64_intdigest(instruction) if hash_keys else instruction
+            output_key = xxh64_intdigest(output) if hash_keys else output
+            if instruction_key in unique_instructions:
+                duplicate_instructions += 1
+            else:
+                unique_instructions.add(instruction_key)
+            if output_key in unique_outputs:
+                duplicate_outputs += 1
+            else:
+                unique_outputs.add(output_key)
+        # 各文字列は1回だけsplitし、語彙集合の更新と語数の両方に使う
+        instruction_words = instruction.split()
+        output_words = output.split()
+        all_words.update(instruction_words, output_words)
+        total_words += len(instruction_words) + len(output_words)
+    
+    scan = {
+        "entry_count": entry_count,
+        "valid_entries": valid_entries,
+        "errors": errors,
+        "stopped_early": stopped_early,
+        "instruction_lengths": instruction_lengths,
+        "output_lengths": output_lengths,
+        "duplicate_instructions": duplicate_instructions,
+        "duplicate_outputs": duplicate_outputs,
+        "unique_word_count": len(all_words),
+        "total_words": total_words,
+    }
+    if use_bloom:
+        scan["duplicate_candidates"] = (unique_instructions, unique_outputs)
+    return scan
+
+def confirm_duplicates(scan: Dict[str, Any], entries: Iterable[Any]):
+    """2パス目: Bloomフィルタの候補だけを出現回数で数え直し、重複数を厳密に確定する"""
+    candidate_instructions, candidate_outputs = scan.pop("duplicate_candidates")
+    instruction_counts = dict.fromkeys(candidate_instructions, 0)
+    output_counts = dict.fromkeys(candidate_outputs, 0)
+    if instruction_counts or output_counts:
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            instruction = entry.get("instruction")
+            output = entry.get("output")
+            if isinstance(instruction, str) and instruction in instruction_counts:
+                instruction_counts[instruction] += 1
+            if isinstance(output, str) and output in output_counts:
+                output_counts[output] += 1
+    # 偽陽性の候補は出現1回なので0として数えられる
+    scan["duplicate_instructions"] = sum(count - 1 for count in instruction_counts.values())
+    scan["duplicate_outputs"] = sum(count - 1 for count in output_counts.values())
+
+def validate_json_structure(scan: Dict[str, Any], filename: str) -> bool:
+    """走査結果から構造の検証結果を出力"""
+    if scan["entry_count"] == 0:
+        error(f"{filename}: データが空です")
+        return False
     
-    success(f"{filename}: {valid_entries}/{len(data)} 個の有効なエントリ")
-    return valid_entries == len(data)
+    for message in scan["errors"]:
+        error(message)
+    if scan["stopped_early"]:
+        error(f"{filename}: 最初のエラーで検証を打ち切りました (--fast)")
+        return False
+    omitted_errors = scan["entry_count"] - scan["valid_entries"] - len(scan["errors"])
+    if omitted_errors > 0:
+        error(f"{filename}: ほか {omitted_errors} 個のエントリにもエラーがあります")
+    
+    success(f"{filename}: {scan['valid_entries']}/{scan['entry_count']} 個の有効なエントリ")
+    return scan["valid_entries"] == scan["entry_count"]
 
-def analyze_dataset_quality(data: List[Dict[str, Any]], filename: str) -> Dict[str, Any]:
+def length_stats(lengths) -> tuple:
+    """整数長の (平均, 最小, 最大)。statistics.meanの厳密な分数計算は不要なのでCのsum/min/maxで集計"""
+    if NUMPY_AVAILABLE:
+        values = np.frombuffer(lengths, dtype=np.intc)  # array('i')はC intの連続領域
+        return float(values.mean()), int(values.min()), int(values.max())
+    return sum(lengths) / len(lengths), min(lengths), max(lengths)
+
+def analyze_dataset_quality(scan: Dict[str, Any], filename: str) -> Dict[str, Any]:
     """データセットの品質を分析"""
-    if not data:
+    instruction_lengths = scan["instruction_lengths"]
+    output_lengths = scan["output_lengths"]
+    if not instruction_lengths:
         return {}
     
-    instruction_lengths = [len(entry["instruction"]) for entry in data]
-    output_lengths = [len(entry["output"]) for entry in data]
-    
+    avg_instruction, min_instruction, max_instruction = length_stats(instruction_lengths)
+    avg_output, min_output, max_output = length_stats(output_lengths)
     analysis = {
-        "entry_count": len(data),
-        "avg_instruction_length": statistics.mean(instruction_lengths),
-        "avg_output_length": statistics.mean(output_lengths),
-        "min_instruction_length": min(instruction_lengths),
-        "max_instruction_length": max(instruction_lengths),
-        "min_output_length": min(output_lengths),
-        "max_output_length": max(output_lengths)
+        "entry_count": len(instruction_lengths),
+        "avg_instruction_length": avg_instruction,
+        "avg_output_length": avg_output,
+        "min_instruction_length": min_instruction,
+        "max_instruction_length": max_instruction,
+        "min_output_length": min_output,
+        "max_output_length": max_output
     }
     
-    info(f"{filename} 品質分析:")
-    info(f"  エントリ数: {analysis['entry_count']}")
-    info(f"  平均指示長: {analysis['avg_instruction_length']:.1f} 文字")
-    info(f"  平均出力長: {analysis['avg_output_length']:.1f} 文字")
-    info(f"  指示長範囲: {analysis['min_instruction_length']}-{analysis['max_instruction_length']} 文字")
-    info(f"  出力長範囲: {analysis['min_output_length']}-{analysis['max_output_length']} 文字")
+    info_lines([
+        f"{filename} 品質分析:",
+        f"  エントリ数: {analysis['entry_count']}",
+        f"  平均指示長: {analysis['avg_instruction_length']:.1f} 文字",
+        f"  平均出力長: {analysis['avg_output_length']:.1f} 文字",
+        f"  指示長範囲: {analysis['min_instruction_length']}-{analysis['max_instruction_length']} 文字",
+        f"  出力長範囲: {analysis['min_output_length']}-{analysis['max_output_length']} 文字",
+    ])
     
     # 品質警告
     if analysis['avg_instruction_length'] < 10:
@@ -106,52 +302,91 @@ def analyze_dataset_quality(data: List[Dict[str, Any]], filename: str) -> Dict[s
     
     return analysis
 
-def check_content_diversity(data: List[Dict[str, Any]], filename: str):
+def check_content_diversity(scan: Dict[str, Any], filename: str):
     """コンテンツの多様性をチェック"""
-    instructions = [entry["instruction"] for entry in data]
-    outputs = [entry["output"] for entry in data]
-    
     # 重複チェック
-    unique_instructions = set(instructions)
-    unique_outputs = set(outputs)
-    
-    if len(unique_instructions) < len(instructions):
-        warning(f"{filename}: 重複する指示文があります ({len(instructions) - len(unique_instructions)} 個)")
+    if scan["duplicate_instructions"]:
+        warning(f"{filename}: 重複する指示文があります ({scan['duplicate_instructions']} 個)")
     else:
         success(f"{filename}: すべての指示文が一意です")
     
-    if len(unique_outputs) < len(outputs):
-        warning(f"{filename}: 重複する出力文があります ({len(outputs) - len(unique_outputs)} 個)")
+    if scan["duplicate_outputs"]:
+        warning(f"{filename}: 重複する出力文があります ({scan['duplicate_outputs']} 個)")
     else:
         success(f"{filename}: すべての出力文が一意です")
     
     # 語彙の多様性（簡易チェック）
-    all_words = set()
-    for instruction in instructions:
-        all_words.update(instruction.split())
-    for output in outputs:
-        all_words.update(output.split())
-    
-    total_words = sum(len(inst.split()) + len(out.split()) for inst, out in zip(instructions, outputs))
-    diversity_ratio = len(all_words) / total_words if total_words > 0 else 0
+    total_words = scan["total_words"]
+    diversity_ratio = scan["unique_word_count"] / total_words if total_words > 0 else 0
     
     info(f"{filename}: 語彙多様性: {diversity_ratio:.3f} (高いほど良い)")
     if diversity_ratio < 0.3:
         warning(f"{filename}: 語彙の多様性が低い可能性があります")
 
-def validate_dataset_file(filepath: Path) -> bool:
-    """単一のデータセットファイルを検証"""
-    print_colored(f"\n📋 {filepath.name} の検証", "blue")
-    print("-" * 50)
+def scan_file(filepath: str, size: int, fast: bool = False, diversity: bool = True) -> Dict[str, Any]:
+    """ファイルを読み込み、1パスで構造検証・統計集計を行う"""
+    filename = os.path.basename(filepath)
+    # バッファなしのFileIO: readall()がファイルサイズ分を1回のread()で直接bytesに読み込む
+    # （BufferedReader経由のコピーを省略。ijsonは自前で64KB単位に読む）
+    with open(filepath, 'rb', buffering=0) as f:
+        if IJSON_AVAILABLE and size >= STREAMING_THRESHOLD_BYTES:
+            # 大きなファイルは逐次パース（配列全体をPythonオブジェクトに展開しない）
+            scan = scan_entries(
+                ijson.items(f, 'item'), filename, fast,
+                use_bloom=BLOOM_AVAILABLE, hash_keys=XXHASH_AVAILABLE, diversity=diversity
+            )
+            if "duplicate_candidates" in scan:
+                if scan["valid_entries"] == scan["entry_count"]:
+                    f.seek(0)
+                    confirm_duplicates(scan, ijson.items(f, 'item'))
+                else:
+                    del scan["duplicate_candidates"]  # 構造エラーがあれば多様性チェックは行わない
+            return scan
+        if ORJSON_AVAILABLE and size > 0:
+            # orjsonはmemoryviewをそのままパースできるので、mmapしたページをbytesにコピーせずに渡す
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                data = json_loads(view)
+        else:
+            # バイト列のままパース（テキストデコードを省略）
+            data = json_loads(f.read())
+    if not isinstance(data, list):
+        raise DatasetFormatError(f"{filename}: データはリスト形式である必要があります")
+    return scan_entries(data, filename, fast, diversity=diversity)
+
+@functools.lru_cache(maxsize=16)
+def cached_scan_file(filepath: str, mtime_ns: int, size: int, fast: bool = False, diversity: bool = True) -> Dict[str, Any]:
+    """scan_fileのメモ化版（パス・更新時刻・サイズが同じファイルはプロセス内で再パースしない）"""
+    return scan_file(filepath, size, fast, diversity)
+
+def load_scan(filepath: str, fast: bool = False, diversity: bool = True) -> Dict[str, Any]:
+    """stat()で存在確認し、(パス, 更新時刻, サイズ)が同じなら前回の走査結果を再利用（ワーカープロセスからも呼ばれる）"""
+    stat = os.stat(filepath)
+    return cached_scan_file(os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size, fast, diversity)
+
+def validate_dataset_file(filepath: str, pending_scan: Optional[Future] = None, fast: bool = False,
+                          diversity: bool = True) -> bool:
+    """単一のデータセットファイルを検証（出力はファイル単位でまとめて書き出す）"""
+    try:
+        return run_dataset_checks(filepath, pending_scan, fast, diversity)
+    finally:
+        flush_output()
+
+def run_dataset_checks(filepath: str, pending_scan: Optional[Future] = None, fast: bool = False,
+                       diversity: bool = True) -> bool:
+    """検証本体（pending_scanがあればワーカーの走査結果を使用）"""
+    filename = os.path.basename(filepath)
+    print_colored(f"\n📋 {filename} の検証", "blue")
+    emit("-" * 50)
     
-    if not filepath.exists():
+    try:
+        scan = pending_scan.result() if pending_scan is not None else load_scan(filepath, fast, diversity)
+    except FileNotFoundError:
         error(f"ファイルが見つかりません: {filepath}")
         return False
-    
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-    except json.JSONDecodeError as e:
+    except DatasetFormatError as e:
+        error(str(e))
+        return False
+    except JSON_ERRORS as e:  # orjson.JSONDecodeErrorはjson.JSONDecodeErrorのサブクラス
         error(f"JSONパースエラー: {e}")
         return False
     except Exception as e:
@@ -159,39 +394,48 @@ def validate_dataset_file(filepath: Path) -> bool:
         return False
     
     # 構造検証
-    structure_valid = validate_json_structure(data, filepath.name)
+    structure_valid = validate_json_structure(scan, filename)
     
     if structure_valid:
         # 品質分析
-        analyze_dataset_quality(data, filepath.name)
+        analyze_dataset_quality(scan, filename)
         
         # 多様性チェック
-        check_content_diversity(data, filepath.name)
+        if diversity:
+            check_content_diversity(scan, filename)
     
     return structure_valid
 
 def main():
     """メイン関数"""
+    parser = argparse.ArgumentParser(description="チュートリアル用データセットの形式と品質を検証します")
+    parser.add_argument("--fast", action="store_true", help="最初のエラーで各ファイルの検証を打ち切る（合否だけが必要なCI向け）")
+    parser.add_argument("--no-diversity", action="store_true", help="重複・語彙多様性のチェックを省略する（単語集合の構築を行わない）")
+    args = parser.parse_args()
+    diversity = not args.no_diversity
+
     print_colored("🔍 LoRAチュートリアル データセット検証", "blue")
-    print("=" * 60)
+    emit("=" * 60)
     
     # チュートリアルディレクトリを探す
-    current_dir = Path.cwd()
+    current_dir = os.getcwd()
     tutorial_dir = None
     
     # カレントディレクトリからチュートリアルディレクトリを探す
-    for path in [current_dir / "tutorial", current_dir.parent / "tutorial", current_dir]:
-        if (path / "datasets").exists():
+    for path in (os.path.join(current_dir, "tutorial"), os.path.join(os.path.dirname(current_dir), "tutorial"), current_dir):
+        if os.path.isdir(os.path.join(path, "datasets")):
             tutorial_dir = path
             break
     
     if not tutorial_dir:
         error("チュートリアルディレクトリが見つかりません")
         error("このスクリプトはプロジェクトルートまたはtutorialディレクトリで実行してください")
+        flush_output()
         sys.exit(1)
     
-    datasets_dir = tutorial_dir / "datasets"
+    datasets_dir = os.path.join(tutorial_dir, "datasets")
     info(f"データセットディレクトリ: {datasets_dir}")
+    flush_output()
     
     # 検証するファイルリスト
     dataset_files = [
@@ -202,24 +446,35 @@ def main():
     
     valid_count = 0
     total_count = len(dataset_files)
+    filepaths = [os.path.join(datasets_dir, filename) for filename in dataset_files]
     
     # 各データセットファイルを検証
-    for filename in dataset_files:
-        filepath = datasets_dir / filename
-        if validate_dataset_file(filepath):
-            valid_count += 1
+    total_bytes = sum(os.path.getsize(filepath) for filepath in filepaths if os.path.isfile(filepath))
+    if total_bytes >= PARALLEL_MIN_BYTES and total_count > 1:
+        # パース・走査はファイルごとに独立したCPU処理なので別プロセスで並列実行し、表示は親でファイル順に行う
+        with ProcessPoolExecutor(max_workers=min(total_count, os.cpu_count() or 1)) as executor:
+            pending_scans = [executor.submit(load_scan, filepath, args.fast, diversity) for filepath in filepaths]
+            for filepath, pending_scan in zip(filepaths, pending_scans):
+                if validate_dataset_file(filepath, pending_scan, args.fast, diversity):
+                    valid_count += 1
+    else:
+        for filepath in filepaths:
+            if validate_dataset_file(filepath, fast=args.fast, diversity=diversity):
+                valid_count += 1
     
     # 最終結果
     print_colored(f"\n📊 検証結果", "blue")
-    print("=" * 30)
+    emit("=" * 30)
     
     if valid_count == total_count:
         success(f"すべてのデータセット ({valid_count}/{total_count}) が検証をパスしました！")
         info("\nデータセットはチュートリアルで使用する準備ができています。")
+        flush_output()
         sys.exit(0)
     else:
         error(f"一部のデータセットに問題があります ({valid_count}/{total_count} が有効)")
         info("\n問題のあるデータセットを修正してから再度実行してください。")
+        flush_output()
         sys.exit(1)
 
 if __name__ == "__main__":